@@ -1,18 +1,24 @@
 import sqlite3
 import argparse
-import matplotlib.pyplot as plt
 from os import path
 import json
 import os
 import numpy as np
-from fuzzywuzzy import process
-from fuzzywuzzy import fuzz
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from fuzzy import FuzzyIndex
+from snapshot import Snapshot, export_snapshot
 from utils import (
     recalculate_depth_tree,
     recalculate_yield,
     remove_nothings,
     recalculate_shortest_path,
+    verify_depth_tree,
+    verify_shortest_path,
+    read_group,
 )
+from migrations import migrate
 
 # ANSI escape codes for color
 red = "\033[1;31m"
@@ -26,49 +32,333 @@ reset = "\033[1;0m"
 root = path.dirname(__file__)
 
 
-# Greedily find a path to create the target element
-def find_path(cur, target, paths={}) -> dict[str, None | tuple[str, str]]:
-    if target in paths:
+# Raised when an element exists but no recipe chain from the base elements
+# can be followed to it
+class NoPathError(LookupError):
+    pass
+
+
+# Whether a recipe with inputs at depths d1 and d2 can be on a path to an
+# element at depth, which needs both inputs to be known and shallower
+def _usable(depth, d1, d2):
+    return d1 is not None and d2 is not None and max(d1, d2) < depth
+
+
+# Resolves crafting paths. Each element's recipe comes from the shortest_path
+# table, falling back to a search of its recipes when the stored path is
+# missing or no longer shallower than the element, and is memoized so every
+# path found through the same PathFinder shares the work.
+class PathFinder:
+    def __init__(self, cur):
+        self.cur = cur
+        # Element -> depth
+        self.depths = {}
+        # Element -> (input1, input2), or None for the base elements
+        self.recipes = {}
+
+    # Resolve every element with a valid shortest path in one query
+    def load(self):
+        for text, depth, a, b, d1, d2 in self.cur.execute(
+            """
+            SELECT elements.text, elements.depth, input1, input2, e1.depth, e2.depth
+                FROM elements
+                LEFT JOIN shortest_path ON output = elements.text
+                LEFT JOIN elements AS e1 ON input1 = e1.text
+                LEFT JOIN elements AS e2 ON input2 = e2.text
+                WHERE elements.depth IS NOT NULL
+            """
+        ).fetchall():
+            self.depths[text] = depth
+            if depth == 0:
+                self.recipes[text] = None
+            elif a is not None and _usable(depth, d1, d2):
+                self.recipes[text] = (a, b)
+
+    def depth(self, text):
+        if text not in self.depths:
+            row = self.cur.execute(
+                "SELECT depth FROM elements WHERE text = ?", (text,)
+            ).fetchone()
+            if row is None:
+                raise KeyError(text)
+            self.depths[text] = row[0]
+        return self.depths[text]
+
+    # The recipe making text, None for the base elements. Raises KeyError if
+    # the element is missing and NoPathError if it can't be made from the base
+    # elements.
+    def recipe(self, text):
+        if text in self.recipes:
+            return self.recipes[text]
+
+        depth = self.depth(text)
+        if depth is None:
+            raise NoPathError(text)
+
+        if depth == 0:
+            self.recipes[text] = None
+            return None
+
+        row = self.cur.execute(
+            """
+            SELECT input1, input2, e1.depth, e2.depth FROM shortest_path
+                JOIN elements AS e1 ON input1 = e1.text
+                JOIN elements AS e2 ON input2 = e2.text
+                WHERE output = ?
+            """,
+            (text,),
+        ).fetchone()
+
+        if row is None or not _usable(depth, row[2], row[3]):
+            # Find the recipe that creates the element with the lowest sum depth
+            # of inputs. Include only recipes where the inputs have a depth <
+            # output depth, to ensure that recipes have no cycles.
+            row = self.cur.execute(
+                """
+                SELECT input1, input2, e1.depth, e2.depth FROM recipes
+                    JOIN elements AS e1 ON input1 = e1.text
+                    JOIN elements AS e2 ON input2 = e2.text
+                    WHERE output = ?1 AND e1.depth < ?2 AND e2.depth < ?2
+                    ORDER BY e1.depth + e2.depth
+                    LIMIT 1
+                """,
+                (text, depth),
+            ).fetchone()
+            if row is None:
+                raise NoPathError(text)
+
+        a, b, d1, d2 = row
+        self.depths[a] = d1
+        self.depths[b] = d2
+        self.recipes[text] = (a, b)
+        return (a, b)
+
+    # Every element needed to make the target, mapped to its recipe
+    def path(self, target) -> dict[str, None | tuple[str, str]]:
+        paths = {}
+        stack = [target]
+        while len(stack) > 0:
+            text = stack.pop()
+            if text in paths:
+                continue
+
+            recipe = self.recipe(text)
+            paths[text] = recipe
+            if recipe is not None:
+                stack.extend(e for e in recipe if e not in paths)
+
         return paths
 
-    depth_result = cur.execute(
-        "SELECT depth FROM elements WHERE text = ?", (target,)
-    ).fetchone()
 
-    if depth_result is None:
+# Find a path to create the target element
+def find_path(cur, target, finder=None) -> dict[str, None | tuple[str, str]]:
+    if finder is None:
+        finder = PathFinder(cur)
+
+    try:
+        return finder.path(target)
+    except KeyError:
         print(f"{red}Element not found in database:{reset} {target}")
-        return
+        return None
+    except NoPathError as e:
+        message = f"{red}No path from the base elements to {reset}{target}"
+        if e.args[0] != target:
+            message += f"{red}, missing a recipe for {reset}{e.args[0]}"
+        print(message)
+        return None
+
+
+# Write the path to every element to analysis/paths.jsonl, one element per line
+# in order of depth, each step as [input1, input2, output]
+def write_all_paths(cur):
+    finder = PathFinder(cur)
+    finder.load()
+
+    os.makedirs(path.join(root, "analysis"), exist_ok=True)
+    fname = path.join(root, "analysis", "paths.jsonl")
+    count = 0
+    missing = 0
+    with open(fname, "w") as f:
+        for text, depth in cur.execute(
+            "SELECT text, depth FROM elements WHERE depth IS NOT NULL ORDER BY depth, text"
+        ).fetchall():
+            try:
+                paths = finder.path(text)
+            except NoPathError:
+                missing += 1
+                continue
+
+            steps = sorted(
+                (finder.depths[e], e, recipe)
+                for e, recipe in paths.items()
+                if recipe is not None
+            )
+            f.write(
+                json.dumps(
+                    {
+                        "element": text,
+                        "depth": depth,
+                        "path": [[*recipe, e] for _, e, recipe in steps],
+                    },
+                    ensure_ascii=False,
+                )
+                + "\n"
+            )
+            count += 1
+
+    print(f"{green}Paths to {count} elements written to {reset}{fname}")
+    if missing > 0:
+        print(
+            f"{yellow}No path found to {missing} elements, the depths may be stale{reset}"
+        )
+
 
-    depth = depth_result[0]
+# Read everything the reports of elements show with a few grouped queries
+# instead of one set of queries per element. Returns element -> report data.
+def load_reports(cur, elements, finder):
+    cur.execute("DROP TABLE IF EXISTS temp.report_elements")
+    cur.execute("CREATE TEMP TABLE report_elements (text TEXT PRIMARY KEY)")
+    cur.executemany(
+        "INSERT OR IGNORE INTO report_elements VALUES (?)", [(e,) for e in elements]
+    )
 
-    if depth == 0:
-        return {target: None}
+    reports = {}
+    for text, emoji, discovered, depth, y, r, frq in cur.execute(
+        "SELECT elements.* FROM elements JOIN report_elements USING (text)"
+    ):
+        reports[text] = {
+            "element": text,
+            "emoji": emoji,
+            "discovered": bool(discovered),
+            "depth": depth,
+            "yield": y,
+            "recipe_count": r,
+            "freq": frq,
+            "path": [],
+            "creating": [],
+            "using": [],
+        }
+
+    # Recipes making each element, not including the element itself
+    for input1, input2, output in cur.execute(
+        """
+        SELECT input1, input2, output FROM recipes
+            JOIN report_elements ON output = text
+            WHERE input1 <> output AND input2 <> output
+            ORDER BY output, input1, input2
+        """
+    ):
+        # Recipes may name outputs missing from the elements table
+        if output not in reports:
+            continue
+        reports[output]["creating"].append((input1, input2, output))
 
-    # Find the recipe that creates the target element with the lowest sum depth of inputs
-    # Include only recipes where the inputs have a depth < output depth
-    # This is to ensure that recipes have no cycles
-    recipe = cur.execute(
+    # Recipes using each element with a non-empty output, the element first
+    for element, other, output in cur.execute(
+        """
+        SELECT text, input2, output FROM recipes
+            JOIN report_elements ON input1 = text
+            WHERE output NOT IN ('Nothing', text)
+        UNION
+        SELECT text, input1, output FROM recipes
+            JOIN report_elements ON input2 = text
+            WHERE output NOT IN ('Nothing', text)
+        ORDER BY text, output, input2
         """
-        SELECT input1, input2
-        FROM recipes
-        WHERE output = ?
-          AND (SELECT depth FROM elements WHERE text = input1) < ?
-          AND (SELECT depth FROM elements WHERE text = input2) < ?
-        ORDER BY (SELECT depth FROM elements WHERE text = input1) + (SELECT depth FROM elements WHERE text = input2)
-        LIMIT 1
-      """,
-        (target, depth, depth),
-    ).fetchone()
+    ):
+        if element not in reports:
+            continue
+        reports[element]["using"].append((element, other, output))
+
+    cur.execute("DROP TABLE report_elements")
 
-    paths[target] = recipe
+    # The path to each element, as (input1, input2, output, depth) by depth
+    for element, report in reports.items():
+        try:
+            paths = finder.path(element)
+        except LookupError:
+            continue
 
-    if recipe[0] not in paths:
-        paths = {**paths, **find_path(cur, recipe[0], paths)}
+        depths = sorted(((e, finder.depth(e)) for e in paths), key=lambda x: x[1])
+        report["path"] = [(*paths[e], e, d) for e, d in depths if paths[e] is not None]
 
-    if recipe[1] not in paths:
-        paths = {**paths, **find_path(cur, recipe[1], paths)}
+    return reports
 
-    return paths
+
+def render_report(report):
+    element = report["element"]
+    lines = [f"# {report['emoji']} {element}\n\n"]
+
+    # -----------------------------------------------------------
+    # Details
+    # -----------------------------------------------------------
+
+    lines.append(f"## Details\n\n")
+    lines.append(f"**First Discovery:** {'Yes' if report['discovered'] else 'No'}\n\n")
+    lines.append(f"**Depth:** {report['depth']}\n\n")
+    lines.append(
+        f"This element has been used {report['recipe_count']} times to create {report['yield']} unique elements\n\n"
+    )
+    lines.append(
+        f"This element has been created by {report['freq']} recipes not including the element itself\n\n"
+    )
+    lines.append(f"---\n\n")
+
+    # -----------------------------------------------------------
+    # Possible Path
+    # -----------------------------------------------------------
+
+    lines.append(f"## Possible Path\n\n")
+
+    # Get the length of the longest element name for padding
+    max_length = max(
+        [len(x) for a, b, e, _ in report["path"] for x in (a, b, e)], default=0
+    )
+
+    lines.append(f"```\n")
+    for a, b, e, d in report["path"]:
+        lines.append(
+            f"{a:{max_length}} + {b:{max_length}} = {e:{max_length}} (depth {d})\n"
+        )
+    lines.append(f"```\n")
+
+    # -----------------------------------------------------------
+    # Recipes
+    # -----------------------------------------------------------
+
+    lines.append(f"## Recipes Creating {element}\n\n")
+
+    # Create a table of recipes
+    lines.append(f"| Input 1 | Input 2 | Output |\n")
+    lines.append(f"| ------- | ------- | ------ |\n")
+    for recipe in report["creating"]:
+        lines.append(f"| {recipe[0]} | {recipe[1]} | {recipe[2]} |\n")
+
+    lines.append(f"---\n\n")
+
+    if len(report["using"]) > 0:
+        lines.append(f"## Recipes Using {element}\n\n")
+
+        lines.append(f"| Input 1 | Input 2 | Output |\n")
+        lines.append(f"| ------- | ------- | ------ |\n")
+        for recipe in report["using"]:
+            lines.append(f"| {recipe[0]} | {recipe[1]} | {recipe[2]} |\n")
+    else:
+        lines.append(f"**No recipes using {element}**\n\n")
+
+    return "".join(lines)
+
+
+def report_path(element):
+    return path.join(root, "analysis", "elements", element, "summary.md")
+
+
+def write_report(report):
+    fname = report_path(report["element"])
+    os.makedirs(path.dirname(fname), exist_ok=True)
+    with open(fname, "w") as f:
+        f.write(render_report(report))
+    return fname
 
 
 def summarize_elements(cur, element):
@@ -79,15 +369,8 @@ def summarize_elements(cur, element):
         ).fetchone()[0]
         == 0
     ):
-        # Find similar elements
-        similar = cur.execute("SELECT text FROM elements").fetchall()
-        similar = [s for s, in similar]
-
         # Use fuzzy matching to find similar elements
-        similar = process.extract(
-            element, similar, limit=5, scorer=fuzz.token_set_ratio
-        )
-        print(similar)
+        similar = FuzzyIndex(cur.connection).suggest(element, 5)
         similar = [s for s, _ in similar]
 
         print(f"{red}Element not found in database:{reset} {element}")
@@ -96,214 +379,249 @@ def summarize_elements(cur, element):
             print(f"\t{s}")
         return
 
-    # Create a directory for the element
-    element_path = path.join(root, "analysis", "elements", element)
-    if not path.exists(element_path):
-        os.makedirs(element_path, exist_ok=True)
-
-    # Write a markdown file with summary information about this element
-    with open(path.join(element_path, f"summary.md"), "w") as f:
-        # Get the row for the element
-        _, emoji, discovered, depth, y, r, frq = cur.execute(
-            "SELECT * FROM elements WHERE text = ?", (element,)
-        ).fetchone()
-
-        f.write(f"# {emoji} {element}\n\n")
-
-        print(
-            f"{green}Summary written to {reset}{path.join(element_path, 'summary.md')}"
-        )
-
-        # -----------------------------------------------------------
-        # Details
-        # -----------------------------------------------------------
+    report = load_reports(cur, [element], PathFinder(cur))[element]
+    fname = write_report(report)
+    print(f"{green}Summary written to {reset}{fname}")
 
-        f.write(f"## Details\n\n")
 
-        f.write(f"**First Discovery:** {'Yes' if discovered else 'No'}\n\n")
+# Elements picked by a report selector: "all", a depth range "depth:LOW-HIGH"
+# (either end may be left out) or "group:NAME" for a file read by read_group
+def select_elements(cur, selector):
+    if selector == "all":
+        return [text for text, in cur.execute("SELECT text FROM elements")]
 
-        f.write(f"**Depth:** {depth}\n\n")
-        f.write(
-            f"This element has been used {r} times to create {y} unique elements\n\n"
-        )
-        f.write(
-            f"This element has been created by {frq} recipes not including the element itself\n\n"
-        )
-        f.write(f"---\n\n")
-
-        # -----------------------------------------------------------
-        # Possible Path
-        # -----------------------------------------------------------
-
-        # Write the path to the file
-        f.write(f"## Possible Path\n\n")
-
-        # Find the path to create the element
-        paths = find_path(cur, element)
+    kind, _, value = selector.partition(":")
+    if kind == "depth":
+        low, dash, high = value.partition("-")
+        low = int(low) if low != "" else 0
+        if dash == "":
+            high = low
+        else:
+            high = int(high) if high != "" else None
+        if high is None:
+            rows = cur.execute("SELECT text FROM elements WHERE depth >= ?", (low,))
+        else:
+            rows = cur.execute(
+                "SELECT text FROM elements WHERE depth BETWEEN ? AND ?", (low, high)
+            )
+        return [text for text, in rows]
+    elif kind == "group":
+        return sorted(read_group(value))
 
-        depths = []
+    raise ValueError(f"Invalid report selector {selector}")
 
-        # Get the depths of the elements in the path
-        for e in paths.keys():
-            depth = cur.execute(
-                "SELECT depth FROM elements WHERE text = ?", (e,)
-            ).fetchone()[0]
 
-            depths.append((e, depth))
+def _report_hash(report):
+    return hashlib.sha1(json.dumps(report, ensure_ascii=False).encode()).hexdigest()
 
-        # Sort the elements by depth
-        depths.sort(key=lambda x: x[1])
 
-        # Get the length of the longest element name for padding
-        max_length = max([len(e) for e, _ in depths])
+# Write the reports of every selected element with a pool of worker processes.
+# The hash of each report's data is kept in analysis/elements/reports.json, and
+# reports whose data has not changed since they were written are skipped.
+def summarize_elements_bulk(cur, selector, workers=None, chunk_size=1000, force=False):
+    elements = select_elements(cur, selector)
 
-        f.write(f"```\n")
-        for e, d in depths:
-            if paths[e] is not None:
-                a, b = paths[e]
-                f.write(
-                    f"{a:{max_length}} + {b:{max_length}} = {e:{max_length}} (depth {d})\n"
-                )
+    manifest_file = path.join(root, "analysis", "elements", "reports.json")
+    manifest = {}
+    if not force and path.exists(manifest_file):
+        with open(manifest_file, "r") as f:
+            manifest = json.load(f)
 
-        f.write(f"```\n")
+    finder = PathFinder(cur)
+    finder.load()
 
-        # -----------------------------------------------------------
-        # Recipes
-        # -----------------------------------------------------------
+    written = 0
+    skipped = 0
+    with multiprocessing.Pool(workers) as pool:
+        for start in range(0, len(elements), chunk_size):
+            reports = load_reports(cur, elements[start : start + chunk_size], finder)
 
-        # Get the recipes making the element
+            changed = []
+            for element, report in reports.items():
+                digest = _report_hash(report)
+                if manifest.get(element) == digest and path.exists(
+                    report_path(element)
+                ):
+                    skipped += 1
+                    continue
+                manifest[element] = digest
+                changed.append(report)
 
-        recipes = cur.execute(
-            "SELECT * FROM recipes WHERE output = ? AND input1 <> ? AND input2 <> ?",
-            (element, element, element),
-        ).fetchall()
-        f.write(f"## Recipes Creating {element}\n\n")
+            for _ in pool.imap_unordered(write_report, changed, chunksize=64):
+                written += 1
 
-        # Create a table of recipes
-        f.write(f"| Input 1 | Input 2 | Output |\n")
-        f.write(f"| ------- | ------- | ------ |\n")
-        for recipe in recipes:
-            f.write(f"| {recipe[0]} | {recipe[1]} | {recipe[2]} |\n")
+    os.makedirs(path.dirname(manifest_file), exist_ok=True)
+    with open(manifest_file, "w") as f:
+        json.dump(manifest, f, ensure_ascii=False)
 
-        f.write(f"---\n\n")
+    missing = len(set(elements)) - written - skipped
+    print(
+        f"{green}Wrote {written} element summaries to {reset}{path.join(root, 'analysis', 'elements')}{green}, {skipped} unchanged{reset}"
+    )
+    if missing > 0:
+        print(f"{yellow}{missing} selected elements are not in the database{reset}")
+
+
+# Column arrays of depth (-1 for NULL), yield, recipe_count and discovered,
+# and the number of recipes, read in one pass over the elements table or from
+# a columnar snapshot
+def summary_columns(cur, snapshot=None):
+    if snapshot is not None:
+        # Snapshots store NULL stats as -1, the database query reads them as 0
+        n = snapshot.n_elements
+        return (
+            np.asarray(snapshot.depth[:n]),
+            np.maximum(snapshot.yields[:n], 0),
+            np.maximum(snapshot.recipe_count[:n], 0),
+            np.asarray(snapshot.discovered[:n]),
+            len(snapshot.output),
+        )
 
-        # Get the recipes that use the element and have a non-empty output
-        recipes = cur.execute(
+    columns = np.array(
+        cur.execute(
             """
-            SELECT * FROM recipes
-              WHERE (input1 = ? OR input2 = ?) AND output NOT IN ('Nothing', ?)
-              ORDER BY output
-            """,
-            (
-                element,
-                element,
-                element,
-            ),
-        ).fetchall()
-        if len(recipes) > 0:
-            f.write(f"## Recipes Using {element}\n\n")
-
-            # Create a table of recipes
-            f.write(f"| Input 1 | Input 2 | Output |\n")
-            f.write(f"| ------- | ------- | ------ |\n")
-            for recipe in recipes:
-                if recipe[0] == element:
-                    f.write(f"| {recipe[0]} | {recipe[1]} | {recipe[2]} |\n")
-                else:
-                    f.write(f"| {recipe[1]} | {recipe[0]} | {recipe[2]} |\n")
-        else:
-            f.write(f"**No recipes using {element}**\n\n")
-
-
-def summarize(cur):
-    num_elements = cur.execute("SELECT COUNT(*) FROM elements").fetchone()[0]
+            SELECT COALESCE(depth, -1), COALESCE(yield, 0),
+                COALESCE(recipe_count, 0), COALESCE(discovered, 0)
+                FROM elements
+            """
+        ).fetchall(),
+        dtype=np.int64,
+    ).reshape(-1, 4)
     num_recipes = cur.execute("SELECT COUNT(*) FROM recipes").fetchone()[0]
-    num_discovered = cur.execute(
-        "SELECT COUNT(*) FROM elements WHERE discovered = 1"
-    ).fetchone()[0]
-    num_unused = cur.execute(
-        "SELECT COUNT(*) FROM elements WHERE recipe_count = 0"
-    ).fetchone()[0]
 
-    print(f"{purple}Database summary:{reset}")
-    print(f"  {num_elements} elements")
-    print(f"  {num_recipes} recipes")
-    print(f"  {num_discovered} newly discovered elements")
-    print(f"  {num_unused} elements with no uses")
-
-    # Query the database for element counts by depth
-    depth_counts = cur.execute(
-        "SELECT depth, COUNT(*) FROM elements GROUP BY depth"
-    ).fetchall()
-
-    # Separate the depth and count values into separate lists
-    depths = [row[0] for row in depth_counts]
-    counts = [row[1] for row in depth_counts]
-
-    # Create a bar graph
-    plt.bar(depths, counts)
-    plt.yscale("log")
-
-    # Set labels and title
-    plt.xlabel("Depth")
-    plt.ylabel("Count")
-    plt.title("Element Counts by Depth")
-
-    # Save to analysis/element_counts.png
-    plt.savefig(path.join(root, "analysis", "element_counts.png"))
-    print(
-        f"{green}Element counts by depth written to {reset}{path.join(root, 'analysis', 'element_counts.png')}"
+    return (
+        columns[:, 0],
+        columns[:, 1],
+        columns[:, 2],
+        columns[:, 3].astype(bool),
+        num_recipes,
     )
-    print(f"{purple}Maximum depth:{reset} {max(depths)}")
-
-    # Get all the yields and recipe counts
-    yields_recipes = cur.execute("SELECT yield, recipe_count FROM elements").fetchall()
-
-    # -----------------------------------------------------------
-    # Yield percentage Distribution
-    # -----------------------------------------------------------
 
-    # Convert to percentages (add 1 to avoid division by 0)
-    yields = [a / (b + 1) * 100 for a, b in yields_recipes]
 
-    # Create a histogram of yields
-    plt.clf()
-    plt.hist(yields, bins=range(0, 101, 5))
-    plt.yscale("log")
+# Every number the summary prints or plots, as plain JSON types
+def summary_stats(cur, snapshot=None):
+    depth, yields, recipe_count, discovered, num_recipes = summary_columns(
+        cur, snapshot
+    )
 
-    # Set labels and title
-    plt.xlabel("Yield (Percentage)")
-    plt.ylabel("Count")
-    plt.title("Element Yield Distribution")
+    depth_counts = np.bincount(depth[depth >= 0])
+    depths = np.flatnonzero(depth_counts)
 
-    # Save to analysis/yield_distribution.png
-    plt.savefig(path.join(root, "analysis", "yield_distribution.png"))
-    print(
-        f"{green}Element yield distribution written to {reset}{path.join(root, 'analysis', 'yield_distribution.png')}"
+    # Yield as a percentage of uses (add 1 to avoid division by 0)
+    yield_counts, yield_edges = np.histogram(
+        yields / (recipe_count + 1) * 100, bins=np.arange(0, 101, 5)
     )
 
-    # -----------------------------------------------------------
-    # Recipe count Distribution
-    # -----------------------------------------------------------
+    max_uses = max(int(recipe_count.max(initial=0)), 1)
+    use_counts, use_edges = np.histogram(
+        recipe_count, bins=np.linspace(0, max_uses, 100)
+    )
 
-    # Create a histogram of recipe counts
-    recipes = [b for _, b in yields_recipes]
-    plt.clf()
-    plt.hist(recipes, bins=np.linspace(0, max(recipes), 100))
+    return {
+        "elements": len(depth),
+        "recipes": num_recipes,
+        "discovered": int(discovered.sum()),
+        "unused": int((recipe_count == 0).sum()),
+        "unreachable": int((depth < 0).sum()),
+        "depths": depths.tolist(),
+        "depth_counts": depth_counts[depths].tolist(),
+        "yield_counts": yield_counts.tolist(),
+        "yield_edges": yield_edges.tolist(),
+        "use_counts": use_counts.tolist(),
+        "use_edges": use_edges.tolist(),
+    }
+
+
+# Chart renderers, run in worker processes. They draw on a bare Figure, which
+# renders with the non-interactive Agg backend.
+def _plot_depths(stats, fname):
+    from matplotlib.figure import Figure
+
+    fig = Figure()
+    ax = fig.subplots()
+    ax.bar(stats["depths"], stats["depth_counts"])
+    ax.set_yscale("log")
+    ax.set_xlabel("Depth")
+    ax.set_ylabel("Count")
+    ax.set_title("Element Counts by Depth")
+    fig.savefig(fname)
+    return fname
+
+
+def _plot_yields(stats, fname):
+    from matplotlib.figure import Figure
+
+    edges = stats["yield_edges"]
+    fig = Figure()
+    ax = fig.subplots()
+    ax.hist(edges[:-1], bins=edges, weights=stats["yield_counts"])
+    ax.set_yscale("log")
+    ax.set_xlabel("Yield (Percentage)")
+    ax.set_ylabel("Count")
+    ax.set_title("Element Yield Distribution")
+    fig.savefig(fname)
+    return fname
+
+
+def _plot_uses(stats, fname):
+    from matplotlib.figure import Figure
+
+    edges = stats["use_edges"]
+    fig = Figure()
+    ax = fig.subplots()
+    ax.hist(edges[:-1], bins=edges, weights=stats["use_counts"])
+    ax.set_yscale("log")
+    ax.set_xlabel("Number of Uses")
+    ax.set_ylabel("Number of Elements")
+    ax.set_title("Element Use Distribution")
+    fig.savefig(fname)
+    return fname
+
+
+charts = {
+    "element_counts.png": (_plot_depths, "Element counts by depth"),
+    "yield_distribution.png": (_plot_yields, "Element yield distribution"),
+    "recipe_distribution.png": (_plot_uses, "Element recipe distribution"),
+}
+
+
+# Print a summary of the database and plot its distributions. The numbers are
+# cached in analysis/summary.json, and the charts are only drawn again when
+# they change.
+def summarize(cur, snapshot=None, force=False):
+    stats = summary_stats(cur, snapshot)
 
-    # Use log scale for x axis
-    plt.yscale("log")
+    print(f"{purple}Database summary:{reset}")
+    print(f"  {stats['elements']} elements")
+    print(f"  {stats['recipes']} recipes")
+    print(f"  {stats['discovered']} newly discovered elements")
+    print(f"  {stats['unused']} elements with no uses")
+    if len(stats["depths"]) > 0:
+        print(f"{purple}Maximum depth:{reset} {stats['depths'][-1]}")
+
+    analysis = path.join(root, "analysis")
+    os.makedirs(analysis, exist_ok=True)
+    cache_file = path.join(analysis, "summary.json")
+
+    cached = None
+    if not force and path.exists(cache_file):
+        with open(cache_file, "r") as f:
+            cached = json.load(f)
+
+    if cached == stats and all(path.exists(path.join(analysis, c)) for c in charts):
+        print(f"{green}Charts are up to date in {reset}{analysis}")
+        return
 
-    # Set labels and title
-    plt.xlabel("Number of Uses")
-    plt.ylabel("Number of Elements")
-    plt.title("Element Use Distribution")
+    with ProcessPoolExecutor(len(charts)) as pool:
+        futures = {
+            pool.submit(plot, stats, path.join(analysis, fname)): description
+            for fname, (plot, description) in charts.items()
+        }
+        for future, description in futures.items():
+            print(f"{green}{description} written to {reset}{future.result()}")
 
-    # Save to analysis/recipe_distribution.png
-    plt.savefig(path.join(root, "analysis", "recipe_distribution.png"))
-    print(
-        f"{green}Element recipe distribution written to {reset}{path.join(root, 'analysis', 'recipe_distribution.png')}"
-    )
+    with open(cache_file, "w") as f:
+        json.dump(stats, f)
 
 
 if __name__ == "__main__":
@@ -315,6 +633,13 @@ if __name__ == "__main__":
         action="store_true",
     )
 
+    parser.add_argument(
+        "--from-snapshot",
+        help="Read the summary from a snapshot written by --snapshot instead of the database",
+        type=str,
+        default=None,
+    )
+
     parser.add_argument(
         "--element",
         help="Calculate stats for a specific element",
@@ -322,8 +647,42 @@ if __name__ == "__main__":
         default=None,
     )
 
+    parser.add_argument(
+        "--reports",
+        help="Write summaries for many elements: all, depth:LOW-HIGH or group:NAME",
+        type=str,
+        default=None,
+    )
+
+    parser.add_argument(
+        "--workers",
+        help="Processes writing the summaries, defaults to the number of CPUs",
+        type=int,
+        default=None,
+    )
+
+    parser.add_argument(
+        "--force",
+        help="Rewrite summaries and charts even if their contents have not changed",
+        action="store_true",
+    )
+
     parser.add_argument("--json", help="Output playable JSON", action="store_true")
 
+    parser.add_argument(
+        "--snapshot",
+        help="Export a columnar snapshot of the database, by default to snapshots/latest",
+        nargs="?",
+        const=path.join(root, "snapshots", "latest"),
+        default=None,
+    )
+
+    parser.add_argument(
+        "--all-paths",
+        help="Write the path to every element to analysis/paths.jsonl",
+        action="store_true",
+    )
+
     parser.add_argument(
         "--recalculate-yield", help="Recalculate the yield", action="store_true"
     )
@@ -332,12 +691,31 @@ if __name__ == "__main__":
         "--recalculate-depth", help="Recalculate the depth", action="store_true"
     )
 
+    parser.add_argument(
+        "--depth-engine",
+        help="The engine used to recalculate the depth",
+        choices=["numpy", "sql"],
+        default="numpy",
+    )
+
+    parser.add_argument(
+        "--verify-depth",
+        help="Check the NumPy depth engine against the SQL engine",
+        action="store_true",
+    )
+
     parser.add_argument(
         "--recalculate-shortest-path",
         help="Recalculate the shortest paths",
         action="store_true",
     )
 
+    parser.add_argument(
+        "--verify-incremental",
+        help="Check the incrementally maintained depth and shortest paths against a full rebuild",
+        action="store_true",
+    )
+
     parser.add_argument(
         "--remove-nothings",
         help="Remove recipes with 'Nothing' as an input",
@@ -349,13 +727,24 @@ if __name__ == "__main__":
     con = sqlite3.connect(path.join(root, "infinite_craft.db"))
     cur = con.cursor()
 
+    migrate(con)
+
     if args.remove_nothings:
         remove_nothings(con, cur)
 
     if args.recalculate_depth:
-        recalculate_depth_tree(con, cur)
+        recalculate_depth_tree(con, cur, args.depth_engine)
         print(f"{green}Recalculated depth{reset}")
 
+    if args.verify_depth:
+        mismatches = verify_depth_tree(con, cur)
+        if len(mismatches) == 0:
+            print(f"{green}Depth engines agree{reset}")
+        else:
+            print(f"{red}Depth engines disagree on {len(mismatches)} elements:{reset}")
+            for text, expected, actual in mismatches[:20]:
+                print(f"\t{text}: sql {expected}, numpy {actual}")
+
     if args.recalculate_yield:
         recalculate_yield(con, cur)
         print(f"{green}Recalculated yield{reset}")
@@ -364,6 +753,19 @@ if __name__ == "__main__":
         recalculate_shortest_path(con, cur)
         print(f"{green}Recalculated shortest path{reset}")
 
+    if args.verify_incremental:
+        mismatches = verify_shortest_path(con, cur)
+        if len(mismatches) == 0:
+            print(
+                f"{green}Incremental depth and shortest paths match a full rebuild{reset}"
+            )
+        else:
+            print(
+                f"{red}{len(mismatches)} elements differ from a full rebuild (depth, path depth):{reset}"
+            )
+            for text, expected, actual in mismatches[:20]:
+                print(f"\t{text}: expected {expected}, found {actual}")
+
     if args.json:
         # Only output elements
         elements = cur.execute("SELECT * FROM elements").fetchall()
@@ -379,10 +781,23 @@ if __name__ == "__main__":
                 f"{green}Elements written to {reset}{path.join(root, 'analysis', 'elements.json')}"
             )
 
+    if args.snapshot is not None:
+        n_elements, n_recipes = export_snapshot(cur, args.snapshot)
+        print(
+            f"{green}Snapshot of {n_elements} elements and {n_recipes} recipes written to {reset}{args.snapshot}"
+        )
+
+    if args.all_paths:
+        write_all_paths(cur)
+
     if args.summary:
-        summarize(cur)
+        snapshot = None if args.from_snapshot is None else Snapshot(args.from_snapshot)
+        summarize(cur, snapshot, force=args.force)
 
     if args.element is not None:
         summarize_elements(cur, args.element)
 
+    if args.reports is not None:
+        summarize_elements_bulk(cur, args.reports, args.workers, force=args.force)
+
     con.close()
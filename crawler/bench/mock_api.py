@@ -0,0 +1,119 @@
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Local stand-in for the /api/infinite-craft/pair endpoint. Results are a
+# deterministic function of the pair, so runs against the mock are repeatable.
+
+
+# Deterministic result for a pair, drawn from a universe of `elements` names
+def mock_result(a, b, elements=100_000, nothing=0.1):
+    a, b = sorted((a, b))
+    h = int.from_bytes(hashlib.blake2b(f"{a}\0{b}".encode()).digest()[:8], "little")
+
+    if (h % 1000) / 1000 < nothing:
+        return "Nothing", False, ""
+
+    h //= 1000
+    # Favour existing inputs now and then, like the real game does
+    if h % 10 == 0:
+        return a, False, ""
+    return f"E{h % elements}", h % 997 == 0, "✨"
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+
+        if url.path != "/api/infinite-craft/pair":
+            self.send_error(404)
+            return
+
+        if server.latency > 0:
+            time.sleep(server.latency * server.random.uniform(0.5, 1.5))
+
+        with server.lock:
+            server.requests += 1
+            limited = server.random.random() < server.rate_429
+            if limited:
+                server.rate_limited += 1
+
+        if limited:
+            self.send_error(429)
+            return
+
+        query = parse_qs(url.query)
+        try:
+            a = query["first"][0]
+            b = query["second"][0]
+        except KeyError:
+            self.send_error(500)
+            return
+
+        result, is_new, emoji = mock_result(a, b, server.elements)
+        body = json.dumps({"result": result, "isNew": is_new, "emoji": emoji})
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.0, rate_429=0.0, elements=100_000, seed=0):
+        super().__init__(("127.0.0.1", port), MockHandler)
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.elements = elements
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    # Serve from a background thread
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a mock Infinite Craft API")
+
+    parser.add_argument("--port", type=int, default=8000, help="The port to serve on")
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="Mean response latency in seconds"
+    )
+    parser.add_argument(
+        "--rate-429",
+        type=float,
+        default=0.0,
+        help="Fraction of requests answered with a 429",
+    )
+    parser.add_argument(
+        "--elements",
+        type=int,
+        default=100_000,
+        help="The number of distinct elements results are drawn from",
+    )
+
+    args = parser.parse_args()
+
+    server = MockServer(args.port, args.latency, args.rate_429, args.elements)
+    print(f"Serving mock API on {server.url}")
+    print(f"Run the crawler with INFINITE_CRAFT_API={server.url}")
+    server.serve_forever()
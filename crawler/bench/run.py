@@ -0,0 +1,334 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import tempfile
+import time
+import types
+from os import path
+
+import utils
+from engine import AsyncEngine
+from graph import RecipeGraph
+from rate import RateController
+from utils import (
+    RecipeWriter,
+    insert_combination,
+    insert_recipe,
+    recalculate_depth_tree,
+    recalculate_shortest_path,
+    recalculate_yield,
+)
+
+from bench.mock_api import MockServer, mock_result
+from bench.synth import generate
+
+# ANSI escape codes for color
+red = "\033[1;31m"
+green = "\033[1;32m"
+purple = "\033[1;35m"
+reset = "\033[1;0m"
+
+root = path.dirname(path.dirname(path.abspath(__file__)))
+
+benchmarks = {}
+
+
+def benchmark(fn):
+    benchmarks[fn.__name__] = fn
+    return fn
+
+
+# Pick `n` untried pairs of existing elements
+def untried_pairs(cur, n, seed=0):
+    rng = random.Random(seed)
+    graph = RecipeGraph(cur)
+    names = [text for text in graph.names if graph.has_element(text)]
+
+    pairs = set()
+    for _ in range(n * 20):
+        a, b = utils.norm_recipe(rng.choice(names), rng.choice(names))
+        if "Nothing" in (a, b) or graph.is_tried(a, b):
+            continue
+        pairs.add((a, b))
+        if len(pairs) == n:
+            break
+
+    return sorted(pairs)
+
+
+@benchmark
+def insert_recipe_single(con, cur, args):
+    pairs = untried_pairs(cur, args.inserts)
+    log = utils.setup_logging()
+    log.setLevel("WARNING")
+
+    t_start = time.perf_counter()
+    for a, b in pairs:
+        insert_recipe(log, cur, con, a, b, *mock_result(a, b)[::2], False)
+    return time.perf_counter() - t_start, len(pairs)
+
+
+@benchmark
+def insert_recipe_batched(con, cur, args):
+    pairs = untried_pairs(cur, args.inserts)
+    log = utils.setup_logging()
+    log.setLevel("WARNING")
+
+    t_start = time.perf_counter()
+    writer = RecipeWriter(log, con, cur, graph=RecipeGraph(cur))
+    for a, b in pairs:
+        writer.put(a, b, *mock_result(a, b)[::2], False)
+    writer.close()
+    return time.perf_counter() - t_start, len(pairs)
+
+
+@benchmark
+def insert_combination_async(con, cur, args):
+    pairs = untried_pairs(cur, args.requests)
+    log = utils.setup_logging()
+    log.setLevel("WARNING")
+
+    server = MockServer(latency=args.latency, rate_429=args.rate_429).start()
+    utils.api_root = server.url
+
+    controller = RateController(
+        args.rate, min_rate=args.rate / 4, max_rate=args.rate * 4, backoff=1.0
+    )
+    options = types.SimpleNamespace(skip_numeric=False, shard=None)
+
+    t_start = time.perf_counter()
+    with AsyncEngine(log, controller, args.concurrency) as engine:
+        writer = RecipeWriter(log, con, cur, graph=RecipeGraph(cur))
+        insert_combination(log, engine, options, con, cur, writer, pairs)
+    elapsed = time.perf_counter() - t_start
+
+    server.shutdown()
+    return elapsed, len(pairs)
+
+
+@benchmark
+def recalculate_depth_tree_numpy(con, cur, args):
+    t_start = time.perf_counter()
+    recalculate_depth_tree(con, cur, "numpy")
+    return time.perf_counter() - t_start, 1
+
+
+@benchmark
+def recalculate_depth_tree_sql(con, cur, args):
+    t_start = time.perf_counter()
+    recalculate_depth_tree(con, cur, "sql")
+    return time.perf_counter() - t_start, 1
+
+
+@benchmark
+def recalculate_yield_all(con, cur, args):
+    t_start = time.perf_counter()
+    recalculate_yield(con, cur)
+    return time.perf_counter() - t_start, 1
+
+
+@benchmark
+def recalculate_shortest_path_all(con, cur, args):
+    t_start = time.perf_counter()
+    recalculate_shortest_path(con, cur)
+    return time.perf_counter() - t_start, 1
+
+
+@benchmark
+def find_path_deepest(con, cur, args):
+    from analyze import find_path
+
+    targets = [
+        text
+        for text, in cur.execute(
+            "SELECT text FROM elements WHERE depth IS NOT NULL ORDER BY depth DESC LIMIT ?",
+            (args.paths,),
+        )
+    ]
+
+    t_start = time.perf_counter()
+    for target in targets:
+        find_path(cur, target)
+    return time.perf_counter() - t_start, len(targets)
+
+
+@benchmark
+def snapshot_load(con, cur, args):
+    from snapshot import Snapshot, export_snapshot
+
+    with tempfile.TemporaryDirectory() as tmp:
+        dirname = path.join(tmp, "snapshot")
+        export_snapshot(cur, dirname)
+
+        t_start = time.perf_counter()
+        snapshot = Snapshot(dirname)
+        int(snapshot.yields.sum())
+        elapsed = time.perf_counter() - t_start
+        del snapshot
+
+    return elapsed, 1
+
+
+def git_commit():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=root,
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.recipes:
+            synthetic = path.join(tmp, f"synthetic-{size}.db")
+
+            print(f"{purple}Generating {size} recipes{reset}")
+            with contextlib.redirect_stdout(io.StringIO()):
+                n_recipes, n_elements = generate(synthetic, size, seed=args.seed)
+
+            for name, fn in benchmarks.items():
+                if args.only and name not in args.only:
+                    continue
+
+                # Every benchmark gets a fresh copy of the database
+                copy = path.join(tmp, "bench.db")
+                if path.exists(copy):
+                    os.remove(copy)
+                src = sqlite3.connect(synthetic)
+                con = sqlite3.connect(copy)
+                src.backup(con)
+                src.close()
+
+                with contextlib.redirect_stdout(io.StringIO()):
+                    seconds, ops = fn(con, con.cursor(), args)
+                con.close()
+
+                print(
+                    f"  {name:32} {seconds:10.4f}s {ops:8} ops {seconds / max(ops, 1) * 1000:10.4f}ms/op"
+                )
+                results.append(
+                    {
+                        "name": name,
+                        "recipes": n_recipes,
+                        "elements": n_elements,
+                        "seconds": seconds,
+                        "ops": ops,
+                    }
+                )
+
+    return {
+        "commit": git_commit(),
+        "time": time.time(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "results": results,
+    }
+
+
+# Print the change in time per op against an earlier results file
+def compare(old, new):
+    old = {(r["name"], r["recipes"]): r for r in old["results"]}
+
+    for r in new["results"]:
+        before = old.get((r["name"], r["recipes"]))
+        if before is None:
+            continue
+
+        ratio = (before["seconds"] / max(before["ops"], 1)) / max(
+            r["seconds"] / max(r["ops"], 1), 1e-12
+        )
+        color = green if ratio >= 1 else red
+        print(f"  {r['name']:32} {r['recipes']:10} recipes {color}{ratio:6.2f}x{reset}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the crawler hot paths")
+
+    parser.add_argument(
+        "--recipes",
+        type=int,
+        nargs="+",
+        default=[10_000],
+        help="The synthetic database sizes to benchmark",
+    )
+    parser.add_argument(
+        "--only",
+        type=str,
+        nargs="+",
+        choices=list(benchmarks),
+        default=[],
+        help="Only run these benchmarks",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="The random seed")
+    parser.add_argument(
+        "--inserts", type=int, default=2000, help="Recipes inserted per benchmark"
+    )
+    parser.add_argument(
+        "--requests", type=int, default=500, help="Requests sent to the mock API"
+    )
+    parser.add_argument(
+        "--paths", type=int, default=100, help="Elements to find paths for"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="Mock API latency in seconds"
+    )
+    parser.add_argument(
+        "--rate-429",
+        type=float,
+        default=0.0,
+        help="Fraction of mock API requests answered with a 429",
+    )
+    parser.add_argument(
+        "--rate", type=float, default=200.0, help="Initial requests per second"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=50, help="In-flight requests"
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        type=str,
+        default=None,
+        help="Where to write the JSON results (Defaults to bench/results/<commit>.json)",
+    )
+    parser.add_argument(
+        "--compare",
+        type=str,
+        default=None,
+        help="A previous results file to compare against",
+    )
+
+    args = parser.parse_args()
+
+    report = run(args)
+
+    output = args.output
+    if output is None:
+        os.makedirs(path.join(root, "bench", "results"), exist_ok=True)
+        output = path.join(
+            root, "bench", "results", f"{report['commit'] or 'local'}.json"
+        )
+
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"{green}Results written to {reset}{output}")
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            print(f"{purple}Compared to {args.compare}:{reset}")
+            compare(json.load(f), report)
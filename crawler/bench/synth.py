@@ -0,0 +1,126 @@
+import argparse
+import sqlite3
+
+import numpy as np
+
+from migrations import migrate
+from utils import recalculate_depth_tree, recalculate_shortest_path, recalculate_yield
+
+base_elements = ["Water", "Fire", "Wind", "Earth"]
+
+
+def element_name(i):
+    return base_elements[i] if i < len(base_elements) else f"E{i}"
+
+
+# Generate a synthetic database with roughly `recipes` recipes. Every element
+# gets one recipe from elements created before it, so the whole graph is
+# reachable, and the rest are random pairs with random outputs.
+def generate(fname, recipes=10_000, elements=None, seed=0, nothing=0.1):
+    rng = np.random.default_rng(seed)
+
+    if elements is None:
+        # Real saves have a few recipes per element
+        elements = max(len(base_elements) + 1, recipes // 8)
+
+    n_base = len(base_elements)
+
+    # One recipe creating each element from earlier elements
+    targets = np.arange(n_base, elements, dtype=np.int64)
+    spine_a = (rng.random(len(targets)) * targets).astype(np.int64)
+    spine_b = (rng.random(len(targets)) * targets).astype(np.int64)
+
+    # Every spine pair has to be unique, or the dedup below would drop the
+    # only recipe of an element. Draw the colliding pairs again until none are
+    # left.
+    while True:
+        key = np.minimum(spine_a, spine_b) * elements + np.maximum(spine_a, spine_b)
+        _, first = np.unique(key, return_index=True)
+        again = np.ones(len(targets), dtype=bool)
+        again[first] = False
+        if not again.any():
+            break
+        spine_a[again] = (rng.random(again.sum()) * targets[again]).astype(np.int64)
+        spine_b[again] = (rng.random(again.sum()) * targets[again]).astype(np.int64)
+
+    # Random recipes, a tenth of which create Nothing (-1)
+    extra = max(0, recipes - len(targets))
+    extra_a = rng.integers(0, elements, extra)
+    extra_b = rng.integers(0, elements, extra)
+    extra_out = rng.integers(0, elements, extra)
+    extra_out[rng.random(extra) < nothing] = -1
+
+    a = np.concatenate([spine_a, extra_a])
+    b = np.concatenate([spine_b, extra_b])
+    out = np.concatenate([targets, extra_out])
+
+    # Normalize the pairs and drop duplicates, keeping the spine recipe
+    lo = np.minimum(a, b)
+    hi = np.maximum(a, b)
+    _, keep = np.unique(lo * elements + hi, return_index=True)
+    keep.sort()
+    lo, hi, out = lo[keep], hi[keep], out[keep]
+
+    con = sqlite3.connect(fname)
+    cur = con.cursor()
+    migrate(con)
+
+    cur.execute("PRAGMA synchronous = OFF")
+
+    cur.executemany(
+        "INSERT OR IGNORE INTO elements VALUES (?, '', 0, NULL, 0, 0, 0)",
+        ((element_name(i),) for i in range(elements)),
+    )
+    cur.execute(
+        "INSERT OR IGNORE INTO elements VALUES ('Nothing', '', 0, NULL, 0, 0, 0)"
+    )
+
+    def name(i):
+        return "Nothing" if i < 0 else element_name(i)
+
+    # Recipes are stored with their inputs sorted by text, like norm_recipe
+    cur.executemany(
+        "INSERT OR IGNORE INTO recipes VALUES (?, ?, ?)",
+        (
+            (*sorted((element_name(x), element_name(y))), name(o))
+            for x, y, o in zip(lo.tolist(), hi.tolist(), out.tolist())
+        ),
+    )
+    con.commit()
+
+    recalculate_depth_tree(con, cur)
+    recalculate_yield(con, cur)
+    recalculate_shortest_path(con, cur)
+
+    unreachable = cur.execute(
+        "SELECT COUNT(*) FROM elements WHERE depth IS NULL AND text <> 'Nothing'"
+    ).fetchone()[0]
+    assert unreachable == 0, f"{unreachable} synthetic elements are unreachable"
+
+    cur.execute("PRAGMA synchronous = FULL")
+    con.close()
+
+    return len(keep), elements
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic database")
+
+    parser.add_argument("output", type=str, help="The database to write")
+    parser.add_argument(
+        "--recipes", type=int, default=10_000, help="The number of recipes"
+    )
+    parser.add_argument(
+        "--elements",
+        type=int,
+        default=None,
+        help="The number of elements (Defaults to an eighth of the recipes)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="The random seed")
+
+    args = parser.parse_args()
+
+    n_recipes, n_elements = generate(
+        args.output, args.recipes, args.elements, args.seed
+    )
+    print(f"Generated {n_recipes} recipes over {n_elements} elements")
@@ -0,0 +1,118 @@
+import heapq
+import itertools
+
+from graph import pack
+
+# Best-first search towards elements that have not been discovered yet. The
+# elements reachable from the start set are combined in the order a heuristic
+# ranks their pairs, instead of expanding every pair blindly.
+#
+# Heuristics score single elements, higher is better, and a pair scores the
+# sum of its two inputs.
+
+
+# Prefer shallow elements, which are cheap to make again
+def depth_heuristic(graph):
+    def score(text):
+        d = graph.get_depth(text)
+        return -d if d is not None else float("-inf")
+
+    return score
+
+
+# Prefer elements that have made many different elements per recipe
+def yield_heuristic(graph):
+    def score(text):
+        i = graph.id(text)
+        return graph.yields[i] / (graph.recipe_count[i] + 1)
+
+    return score
+
+
+# Prefer elements whose name is close to one of the targets in a word2vec model
+def similarity_heuristic(model, targets):
+    from embeddings import vector_similarity, word_vectors
+
+    target_vectors = [word_vectors(model, t) for t in targets]
+
+    def score(text):
+        vectors = word_vectors(model, text)
+        return max((vector_similarity(vectors, t) for t in target_vectors), default=0.0)
+
+    return score
+
+
+heuristics = ["similarity", "depth", "yield"]
+
+
+class BestFirstSearch:
+    def __init__(self, graph, start, targets, heuristic, exclude=()):
+        self.graph = graph
+        self.heuristic = heuristic
+        self.targets = set(targets)
+        self.exclude = set(exclude)
+        self.found = []
+
+        # Elements the search can combine, and their cached scores
+        self.elements = []
+        self.scores = {}
+
+        # Pairs waiting to be tried, best first, and every pair ever queued
+        self.frontier = []
+        self.queued = set()
+        self.counter = itertools.count()
+
+        for text in start:
+            self.add(text)
+
+    def __len__(self):
+        return len(self.frontier)
+
+    # Make an element available to the search, queueing its pairs with every
+    # element found so far. Returns False if it was already available.
+    def add(self, text):
+        if text in self.scores:
+            return False
+
+        self.scores[text] = self.heuristic(text)
+        self.elements.append(text)
+
+        for other in self.elements:
+            self._push(text, other)
+        return True
+
+    def _push(self, a, b):
+        key = pack(self.graph.id(a), self.graph.id(b))
+        if key in self.queued:
+            return
+        self.queued.add(key)
+
+        score = self.scores[a] + self.scores[b]
+        heapq.heappush(self.frontier, (-score, next(self.counter), a, b))
+
+    # Follow a tried pair, adding its output to the search
+    def expand(self, a, b):
+        output = self.graph.output(a, b)
+        if output is None or output == "Nothing" or output in self.exclude:
+            return None
+
+        if output in self.targets:
+            self.targets.remove(output)
+            self.found.append(output)
+
+        self.add(output)
+        return output
+
+    # The next k best pairs that still need a request. Pairs tried earlier are
+    # expanded on the way without spending any requests.
+    def next_batch(self, k):
+        batch = []
+        while len(batch) < k and len(self.frontier) > 0 and len(self.targets) > 0:
+            _, _, a, b = heapq.heappop(self.frontier)
+
+            if self.graph.is_tried(a, b):
+                self.expand(a, b)
+            else:
+                batch.append((a, b))
+
+        return batch
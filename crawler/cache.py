@@ -0,0 +1,99 @@
+import sqlite3
+import time
+from os import path
+
+root = path.dirname(__file__)
+
+
+# On-disk cache of combine results, kept in its own SQLite file so results
+# survive a crash before insert_recipe commits. Pairs that keep failing are
+# negative cached, backing off exponentially from ttl up to max_ttl seconds.
+# Callers are expected to pass normalized pairs (see utils.norm_recipe).
+class CombineCache:
+    def __init__(
+        self,
+        fname=path.join(root, "combine_cache.db"),
+        ttl=60 * 10,
+        max_ttl=60 * 60 * 24,
+    ):
+        self.ttl = ttl
+        self.max_ttl = max_ttl
+
+        self.con = sqlite3.connect(fname, timeout=60)
+        self.con.execute("PRAGMA journal_mode = WAL")
+        self.con.execute("PRAGMA synchronous = NORMAL")
+
+        self.con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                input1 TEXT,
+                input2 TEXT,
+                result TEXT,
+                is_new BOOLEAN,
+                emoji TEXT,
+                PRIMARY KEY (input1, input2)
+            )
+            """
+        )
+        self.con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS failures (
+                input1 TEXT,
+                input2 TEXT,
+                attempts INTEGER,
+                retry_after REAL,
+                error TEXT,
+                PRIMARY KEY (input1, input2)
+            )
+            """
+        )
+        self.con.commit()
+
+    def close(self):
+        self.con.close()
+
+    # Get the cached (result, is_new, emoji) of a pair, or None
+    def get(self, a, b):
+        row = self.con.execute(
+            "SELECT result, is_new, emoji FROM results WHERE input1 = ? AND input2 = ?",
+            (a, b),
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], bool(row[1]), row[2]
+
+    # Get the time until which a failing pair should not be retried, or None
+    def retry_after(self, a, b):
+        row = self.con.execute(
+            "SELECT retry_after FROM failures WHERE input1 = ? AND input2 = ?",
+            (a, b),
+        ).fetchone()
+        if row is None or row[0] <= time.time():
+            return None
+        return row[0]
+
+    def put(self, a, b, result, is_new, emoji):
+        self.con.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+            (a, b, result, is_new, emoji),
+        )
+        self.con.execute(
+            "DELETE FROM failures WHERE input1 = ? AND input2 = ?",
+            (a, b),
+        )
+        self.con.commit()
+
+    def fail(self, a, b, error):
+        row = self.con.execute(
+            "SELECT attempts FROM failures WHERE input1 = ? AND input2 = ?",
+            (a, b),
+        ).fetchone()
+        attempts = 1 if row is None else row[0] + 1
+
+        backoff = min(self.ttl * 2 ** (attempts - 1), self.max_ttl)
+
+        self.con.execute(
+            "INSERT OR REPLACE INTO failures VALUES (?, ?, ?, ?, ?)",
+            (a, b, attempts, time.time() + backoff, str(error)),
+        )
+        self.con.commit()
@@ -1,14 +1,41 @@
-import random
 import sqlite3
-from utils import norm_recipe, insert_combination, setup_logging, read_group
+from utils import (
+    insert_combination,
+    setup_logging,
+    read_group,
+    RecipeWriter,
+    open_cache,
+    parse_shard,
+)
 import argparse
 import itertools
-import numpy as np
-from wordfreq import word_frequency
-from wordfreq.tokens import lossy_tokenize
 from os import path
 import copy
-import multiprocessing
+import time
+from engine import PoolEngine, AsyncEngine
+from graph import RecipeGraph
+from rate import RateController
+from migrations import migrate
+import metrics
+from embeddings import EmbeddingIndex
+from sampler import WeightedSampler
+from scheduler import Scheduler
+from bestfirst import (
+    BestFirstSearch,
+    depth_heuristic,
+    heuristics,
+    similarity_heuristic,
+    yield_heuristic,
+)
+from frontier import (
+    BfsFrontier,
+    bfs_state_name,
+    clear_state,
+    explore_pairs,
+    load_state,
+    save_state,
+    slowest_shard,
+)
 
 # ANSI escape codes for color
 red = "\033[1;31m"
@@ -32,6 +59,12 @@ def main():
         help="The value to start the bfs at",
     )
 
+    parser.add_argument(
+        "--no-resume",
+        action="store_true",
+        help="Start the bfs and explore algorithms from the beginning instead of where the last crawl stopped",
+    )
+
     parser.add_argument(
         "--key",
         type=str,
@@ -78,6 +111,21 @@ def main():
         default=[],
     )
 
+    parser.add_argument(
+        "--heuristic",
+        type=str,
+        choices=heuristics,
+        default="similarity",
+        help="How the best-first algorithm ranks pairs",
+    )
+
+    parser.add_argument(
+        "--budget",
+        type=int,
+        default=None,
+        help="The maximum number of requests the best-first algorithm may send",
+    )
+
     parser.add_argument(
         "--min-length",
         type=int,
@@ -115,6 +163,12 @@ def main():
         help="Invert the weights for the weighted random algorithm",
     )
 
+    parser.add_argument(
+        "--dump-weights",
+        action="store_true",
+        help="Write the weighted random probabilities to tmp.txt on every batch",
+    )
+
     parser.add_argument(
         "--groups",
         "-g",
@@ -124,13 +178,125 @@ def main():
         default=[],
     )
 
+    parser.add_argument(
+        "--engine",
+        type=str,
+        choices=["pool", "async"],
+        default="pool",
+        help="The engine used to send combine requests",
+    )
+
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=100,
+        help="The maximum number of in-flight requests for the async engine",
+    )
+
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=9.0,
+        help="The initial number of requests per second",
+    )
+
+    parser.add_argument(
+        "--max-rate",
+        type=float,
+        default=50.0,
+        help="The maximum number of requests per second the rate controller will ramp up to",
+    )
+
+    parser.add_argument(
+        "--backoff",
+        type=float,
+        default=30.0,
+        help="Seconds to pause all requests after being rate limited",
+    )
+
+    parser.add_argument(
+        "--write-batch",
+        type=int,
+        default=100,
+        help="The number of results to apply per database transaction",
+    )
+
+    parser.add_argument(
+        "--flush-interval",
+        type=float,
+        default=5.0,
+        help="The maximum number of seconds between database commits",
+    )
+
+    parser.add_argument(
+        "--cache",
+        type=str,
+        default=None,
+        help="The combine cache database (Defaults to combine_cache.db next to the crawler)",
+    )
+
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always fetch combinations from the network",
+    )
+
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=60 * 10,
+        help="Seconds to wait before retrying a failed pair, doubled on every failure",
+    )
+
+    parser.add_argument(
+        "--log-summary",
+        type=float,
+        default=None,
+        help="Print a summary of the recipes found every this many seconds instead of a line per recipe",
+    )
+
+    parser.add_argument(
+        "--event-log",
+        type=str,
+        default=None,
+        help="Append every new element to this JSONL file",
+    )
+
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="Serve Prometheus metrics on http://127.0.0.1:<port>/metrics",
+    )
+
+    parser.add_argument(
+        "--metrics-file",
+        type=str,
+        default=None,
+        help="Write a JSON snapshot of the metrics to this file periodically",
+    )
+
+    parser.add_argument(
+        "--metrics-interval",
+        type=float,
+        default=60.0,
+        help="Seconds between metrics snapshots",
+    )
+
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        default=None,
+        help="Only try the pairs of shard i out of N (0 <= i < N), so N crawlers can share the database",
+    )
+
     args = parser.parse_args()
 
     search = set.union(set(args.search), *[read_group(x) for x in args.groups])
 
-    log = setup_logging()
+    log = setup_logging(args.log_summary, args.event_log)
 
-    if args.batch < 1:
+    if args.batch < 1 or args.concurrency < 1 or args.rate <= 0 or args.write_batch < 1:
         log.error("Invalid arguments")
         exit(1)
 
@@ -139,6 +305,12 @@ def main():
     con = sqlite3.connect(path.join(root, "infinite_craft.db"), timeout=60 * 60)
     cur = con.cursor()
 
+    if args.shard is not None:
+        # Let the other shards read while one of them is writing
+        cur.execute("PRAGMA journal_mode = WAL")
+
+    migrate(con)
+
     # Insert default elements if they don't exist
     default = [
         ("Water", "💧"),
@@ -152,50 +324,147 @@ def main():
             "INSERT OR IGNORE INTO elements VALUES (?, ?, 0, 0, 0, 0, 0)",
             element,
         )
+    con.commit()
+
+    # Load the in-memory index used for the crawler's lookups
+    graph = RecipeGraph(cur)
+    log.info(f"Loaded {len(graph)} elements and {len(graph.recipes)} recipes")
+
+    writer = RecipeWriter(
+        log,
+        con,
+        cur,
+        args.write_batch,
+        args.flush_interval,
+        graph=graph,
+        shared=args.shard is not None,
+    )
+
+    if args.metrics_port is not None:
+        metrics.registry.serve(args.metrics_port)
+        log.info(f"Serving metrics on http://127.0.0.1:{args.metrics_port}/metrics")
+    if args.metrics_file is not None:
+        metrics.registry.write_snapshots(args.metrics_file, args.metrics_interval)
 
     log.info(f"Starting crawler with {args.algorithm} algorithm")
 
     try:
-        with multiprocessing.Pool(20) as pool:
+        if args.no_cache:
+            cache_args = None
+        else:
+            cache_args = (args.cache, args.cache_ttl)
+
+        controller = RateController(
+            args.rate,
+            min_rate=min(args.rate, 0.5),
+            max_rate=max(args.rate, args.max_rate),
+            backoff=args.backoff,
+        )
+
+        if args.engine == "async":
+            engine = AsyncEngine(log, controller, args.concurrency)
+        else:
+            # Every worker process opens its own connection to the cache
+            engine = PoolEngine(
+                controller,
+                20,
+                initializer=open_cache if cache_args is not None else None,
+                initargs=cache_args or (),
+            )
+
+        # The engines check the cache before taking a rate slot. Opened after
+        # the pool forks, so no connection is shared with the workers.
+        if cache_args is not None:
+            open_cache(*cache_args)
+
+        with engine:
             if args.algorithm == "bfs":
                 idx = args.bfs_start
+                after = None
+                state_name = bfs_state_name(args.shard)
+
+                # Resume from the last batch an earlier crawl finished
+                state = None if args.no_resume else load_state(cur, state_name)
+                if (
+                    state is not None
+                    and state["key"] == args.key
+                    and state["sort"] == args.sort
+                    and state["idx"] >= idx
+                ):
+                    idx = state["idx"]
+                    after = state["after"]
+                    log.info(f"Resuming {args.key} {idx} after {after}")
+
                 while True:
-                    # Get all elements with the current idx
-                    delements = cur.execute(
-                        f"SELECT text FROM elements WHERE {args.key} = ? ORDER BY {args.sort}",
-                        (idx,),
-                    ).fetchall()
+                    if (
+                        cur.execute(
+                            f"SELECT COUNT(*) FROM elements WHERE {args.key} >= ?",
+                            (idx,),
+                        ).fetchone()[0]
+                        == 0
+                    ):
+                        log.info(f"No elements with {args.key} >= {idx}, stopping")
+                        break
 
-                    # Get all elements with <= current idx
-                    lelements = cur.execute(
-                        f"SELECT text FROM elements WHERE {args.key} <= ? ORDER BY {args.sort}",
-                        (idx,),
-                    ).fetchall()
+                    frontier = BfsFrontier(
+                        cur, graph, args.key, args.sort, idx, after, args.shard
+                    )
 
                     log.info(
-                        f"Crawling {args.key} {idx}: {len(delements)} X {len(lelements)} = {len(delements) * len(lelements)} recipes to try"
+                        f"Crawling {args.key} {idx}: {len(frontier.delements)} X {len(frontier.lelements)} = {frontier.total} recipes to try"
                     )
 
-                    idx += 1
-
-                    count = 0
-
-                    # Loop through all possible combinations of elements
-                    for (a,) in delements:
-                        batch = []
-                        for (b,) in lelements:
-                            count += 1
+                    pairs = iter(frontier)
+                    while True:
+                        batch = list(itertools.islice(pairs, args.batch))
+                        if len(batch) == 0:
+                            break
+
+                        insert_combination(log, engine, args, con, cur, writer, batch)
+
+                        # The batch is committed, so a restart can skip it
+                        save_state(
+                            cur,
+                            state_name,
+                            {
+                                "key": args.key,
+                                "sort": args.sort,
+                                "idx": idx,
+                                "after": batch[-1],
+                            },
+                        )
+                        con.commit()
 
-                            if count % 1000 == 0:
-                                log.debug(
-                                    f"Progress: {count}/{len(delements) * len(lelements)} ({count / (len(delements) * len(lelements)) * 100:.2f}%)"
-                                )
+                        metrics.pairs.set(frontier.count, state="walked")
+                        metrics.pairs.set(frontier.total, state="total")
+                        log.debug(
+                            f"Progress: {frontier.count}/{frontier.total} ({frontier.count / max(1, frontier.total) * 100:.2f}%)"
+                        )
 
-                            if count % args.batch == 0:
-                                insert_combination(log, pool, args, con, cur, batch)
-                                batch = []
+                    idx += 1
+                    after = None
+                    save_state(
+                        cur,
+                        state_name,
+                        {"key": args.key, "sort": args.sort, "idx": idx, "after": None},
+                    )
+                    con.commit()
+
+                    # The next level is made of elements every shard finds on
+                    # this one, so wait for the other shards to finish it
+                    if args.shard is not None:
+                        while True:
+                            slowest = slowest_shard(
+                                cur, args.key, args.sort, args.shard[1]
+                            )
+                            if slowest is not None and slowest >= idx:
+                                break
+                            log.info(
+                                f"Waiting for the other shards to finish {args.key} {idx - 1}"
+                            )
+                            time.sleep(10)
 
-                            batch.append((a, b))
+                        writer.sync()
             elif args.algorithm == "random":
                 while True:
                     a_s = cur.execute(
@@ -207,113 +476,44 @@ def main():
 
                     insert_combination(
                         log,
-                        pool,
+                        engine,
                         args,
                         con,
                         cur,
+                        writer,
                         itertools.combinations_with_replacement(a_s, 2),
                     )
             elif args.algorithm in ["max-yield", "min-uses", "max-freq"]:
+                scheduler = Scheduler(graph, args.algorithm)
+
                 while True:
-                    # Get all the elements in random order
-                    elements = cur.execute(
-                        "SELECT text FROM elements WHERE text <> 'Nothing' ORDER BY RANDOM()"
-                    ).fetchall()
-                    elements = [x for x, in elements]
+                    # Get the best elements that have not been combined with everything
+                    _a = scheduler.top(args.batch)
+
+                    if len(_a) == 0:
+                        log.info("Every element has been combined with every other")
+                        break
+
+                    for a in _a:
+                        i = graph.id(a)
+                        r = graph.recipe_count[i]
 
-                    nelements = len(elements)
-
-                    if args.algorithm == "max-yield":
-                        # Choose the element with the highest yield
-                        _a = cur.execute(
-                            """
-                            SELECT text, yield, recipe_count FROM elements
-                                WHERE text <> 'Nothing'
-                                    AND recipe_count < ?
-                                ORDER BY (CAST(yield as REAL) / (recipe_count + 1)) DESC LIMIT ?
-                            """,
-                            (nelements, args.batch),
-                        ).fetchall()
-                    elif args.algorithm == "min-uses":
-                        # Get all the elements with the lowest recipe count
-                        _a = cur.execute(
-                            """
-                            SELECT text, yield, recipe_count FROM elements
-                                WHERE text <> 'Nothing'
-                                    AND recipe_count < ?
-                                    AND recipe_count = (SELECT MIN(recipe_count) FROM elements WHERE recipe_count < ?)
-                            """,
-                            (
-                                nelements,
-                                nelements,
-                            ),
-                        ).fetchall()
-                        log.info(
-                            f"Pulled {len(_a)} elements with a recipe count of {_a[0][2]}"
-                        )
-                    elif args.algorithm == "max-freq":
-                        _a = cur.execute(
-                            """
-                            SELECT text, freq, recipe_count FROM elements
-                                WHERE text <> 'Nothing'
-                                    AND recipe_count < ?
-                                ORDER BY freq DESC LIMIT ?
-                            """,
-                            (nelements, args.batch),
-                        ).fetchall()
-
-                    for a, y, r in _a:
                         if args.algorithm == "max-yield":
+                            y = graph.yields[i]
                             log.debug(
                                 f"Max Yield {y}/{r+1} = {y/(r+1):.2f} element {yellow}{a}{reset}"
                             )
                         elif args.algorithm == "min-uses":
                             log.debug(f"Min Uses {r} element {yellow}{a}{reset}")
                         elif args.algorithm == "max-freq":
-                            log.debug(f"Max Freq {y} element {yellow}{a}{reset}")
-
-                        _b = []
-                        if r / nelements < 0.7:
-                            # Decently high chance of choosing a random element that has not been tried
-                            # Just choose a random element until it works
-
-                            for _ in range(args.batch * 10):
-                                bt = random.choice(elements)
-
-                                if (
-                                    cur.execute(
-                                        "SELECT COUNT(*) FROM recipes WHERE input1 = ? AND input2 = ?",
-                                        norm_recipe(a, bt),
-                                    ).fetchone()[0]
-                                    == 0
-                                ):
-                                    _b.append(bt)
-                                    if len(_b) == args.batch:
-                                        break
-
-                        else:
-                            # Get all the recipes that use the element
-                            recipes = cur.execute(
-                                "SELECT input1, input2 FROM recipes WHERE input1 = ? OR input2 = ?",
-                                (a, a),
-                            ).fetchall()
-
-                            # Get the other input for the recipe
-                            other_elems = set(y if x == a else x for x, y in recipes)
-
-                            elements = set(elements)
-
-                            # Get the elements that are not in the recipes
-                            other_elems = list(elements - other_elems)
-
-                            if len(other_elems) < args.batch:
-                                _b = other_elems
-                            else:
-                                # Choose a random element from the set
-                                _b = random.sample(other_elems, args.batch)
+                            log.debug(
+                                f"Max Freq {graph.freq[i]} element {yellow}{a}{reset}"
+                            )
+
+                        _b = scheduler.partners(a, args.batch)
 
                         insert_combination(
-                            log, pool, args, con, cur, [(a, b) for b in _b]
+                            log, engine, args, con, cur, writer, [(a, b) for b in _b]
                         )
 
             elif args.algorithm == "search":
@@ -331,12 +531,7 @@ def main():
 
                 # Make sure the elements exist
                 for element in search:
-                    if (
-                        cur.execute(
-                            "SELECT COUNT(*) FROM elements WHERE text = ?", (element,)
-                        ).fetchone()[0]
-                        == 0
-                    ):
+                    if not graph.has_element(element):
                         log.info(f"{element} does not exist, adding to goals.")
                         search_missing.add(element)
                     else:
@@ -371,23 +566,18 @@ def main():
 
                     log.info(f"Queue length: {len(queue)}")
                     batch = queue[: args.batch]
-                    insert_combination(log, pool, args, con, cur, batch)
+                    insert_combination(log, engine, args, con, cur, writer, batch)
 
                     nqueue = queue[args.batch :]
                     reset_search = False
 
                     for a, b in batch:
                         # Get result if it exists and skip otherwise
-                        res = cur.execute(
-                            "SELECT output FROM recipes WHERE input1 = ? AND input2 = ?",
-                            norm_recipe(a, b),
-                        ).fetchone()
+                        res = graph.output(a, b)
 
                         if res is None:
                             continue
 
-                        res = res[0]
-
                         if res in search or res in search_exclude or res == "Nothing":
                             continue
 
@@ -412,6 +602,70 @@ def main():
                         )
                     else:
                         queue = nqueue
+            elif args.algorithm == "best-first":
+                search_exclude = set(args.search_exclude)
+
+                # The search elements that exist are the start, the rest are goals
+                targets = {x for x in search if not graph.has_element(x)}
+                start = search - targets
+
+                if len(targets) == 0:
+                    log.error(
+                        "No missing elements to search for. Use --search <element> <element> ..."
+                    )
+                    exit(1)
+
+                if len(start) == 0:
+                    start = {"Water", "Fire", "Wind", "Earth"}
+
+                if args.heuristic == "similarity":
+                    import gensim.downloader
+
+                    heuristic = similarity_heuristic(
+                        gensim.downloader.load(args.model), targets
+                    )
+                elif args.heuristic == "depth":
+                    heuristic = depth_heuristic(graph)
+                else:
+                    heuristic = yield_heuristic(graph)
+
+                bfs = BestFirstSearch(graph, start, targets, heuristic, search_exclude)
+                log.info(
+                    f"Searching for {len(targets)} elements from {len(start)} elements by {args.heuristic}"
+                )
+
+                requests = 0
+                while len(bfs.targets) > 0:
+                    if args.budget is not None and requests >= args.budget:
+                        log.info(f"Spent the budget of {args.budget} requests")
+                        break
+
+                    k = args.batch
+                    if args.budget is not None:
+                        k = min(k, args.budget - requests)
+
+                    batch = bfs.next_batch(k)
+                    if len(batch) == 0:
+                        break
+
+                    insert_combination(log, engine, args, con, cur, writer, batch)
+                    requests += len(batch)
+
+                    for a, b in batch:
+                        bfs.expand(a, b)
+
+                    for x in bfs.found:
+                        log.info(f"Found {yellow}{x}{reset} after {requests} requests")
+                    bfs.found.clear()
+
+                    log.debug(
+                        f"{len(bfs.elements)} elements reached, {len(bfs)} pairs queued, {len(bfs.targets)} targets left"
+                    )
+
+                if len(bfs.targets) == 0:
+                    log.info(f"Found every target with {requests} requests")
+                else:
+                    log.info(f"Did not find {', '.join(sorted(bfs.targets))}")
             elif args.algorithm == "shortest":
                 # Sort by shortest words
                 while True:
@@ -450,10 +704,11 @@ def main():
 
                     insert_combination(
                         log,
-                        pool,
+                        engine,
                         args,
                         con,
                         cur,
+                        writer,
                         [(a, b) for a in a_s for b in elements],
                     )
 
@@ -465,41 +720,29 @@ def main():
                 # Load the model
                 model = gensim.downloader.load(args.model)
 
-                def similarity(a, b):
-                    # Split the elements into words
-                    a = a.lower().split()
-                    b = b.lower().split()
-
-                    def sim_single(x, y):
-                        try:
-                            return model.similarity(x, y)
-                        except KeyError:
-                            return 0
-
-                    # Get the l2 norm similarity of all the pairs of words
-                    return np.linalg.norm(
-                        [max(sim_single(x, y) for y in b) for x in a]
-                    ) / (len(a) * len(b))
+                # Word vectors of every element, cached next to the crawler
+                index = EmbeddingIndex(model, args.model)
+                log.info(f"Loaded embeddings for {len(index)} elements")
 
                 batch = args.batch
                 while True:
                     # Get every element
-                    elements = cur.execute(
-                        """
-                        SELECT text FROM elements
-                            WHERE text <> 'Nothing'
-                        """
-                    ).fetchall()
-                    elements = [x for x, in elements if x not in search]
-
-                    # Get the similarity of each element in the search to every other element
-                    a = [(e, max(similarity(e, b) for b in search)) for e in elements]
-                    # Sort the elements by similarity descending
-                    a.sort(key=lambda x: x[1], reverse=True)
-
-                    # Get the top batch elements
-                    a = a[:batch]
-                    a = [x for x, _ in a]
+                    elements = [
+                        x
+                        for x in graph.names
+                        if graph.has_element(x) and x != "Nothing"
+                    ]
+
+                    # Embed the elements discovered since the last loop
+                    added = index.update(elements)
+                    if added > 0:
+                        log.debug(f"Embedded {added} new elements")
+                        index.save()
+
+                    # Get the top batch elements by similarity to the search
+                    a = index.top_k(
+                        search, batch, [x for x in elements if x not in search]
+                    )
 
                     log.debug(f"Searching for {", ".join(search)}")
                     log.debug(f"Top {batch} elements: \n\t{", ".join(a)}")
@@ -507,10 +750,11 @@ def main():
                     # Loop through all pairs of elements
                     any_found = insert_combination(
                         log,
-                        pool,
+                        engine,
                         args,
                         con,
                         cur,
+                        writer,
                         itertools.combinations_with_replacement(a, 2),
                     )
 
@@ -519,127 +763,93 @@ def main():
                         batch += max(1, args.batch // 2)
             elif args.algorithm == "weighted-random":
                 # Weighted by word commonality
-                while True:
-                    # Get every element
-                    data = cur.execute(
-                        """
-                        SELECT text, depth, yield, recipe_count, freq FROM elements
-                            WHERE text <> 'Nothing'
-                            ORDER BY depth ASC
-                        """
-                    ).fetchall()
+                if args.key not in WeightedSampler.keys:
+                    log.error(f"Invalid key {args.key}")
+                    exit(1)
 
-                    l = ["depth", "yield", "recipe_count", "freq"]
-                    elements = [x[0] for x in data]
-
-                    log.debug(f"Weighting by {args.key}")
-
-                    if args.key == "commonality":
-                        new_elements = []
-
-                        normalized_words = set()
-                        for element in elements:
-                            normalized = tuple(lossy_tokenize(element, "en"))
-                            if normalized in normalized_words:
-                                continue
-                            if args.only_word and len(normalized) > 1:
-                                continue
-                            normalized_words.add(normalized)
-                            # Keep only one element per normalized word, ordered by depth
-                            new_elements.append(element)
-
-                        elements = new_elements
-
-                        probabilities = [
-                            word_frequency(x, "en", wordlist="large")
-                            / max(1, len(lossy_tokenize(x, "en"))) ** 2
-                            for x in elements
-                        ]
-                    elif args.key in l:
-                        if args.key == "yield":
-                            probabilities = [(x[2] / (x[3] + 1)) ** 4 for x in data]
-                        else:
-                            index = l.index(args.key)
-                            probabilities = [x[index + 1] for x in data]
-                    else:
-                        log.error(f"Invalid key {args.key}")
-                        exit(1)
+                log.debug(f"Weighting by {args.key}")
+                sampler = WeightedSampler(graph, args.key, args.invert, args.only_word)
 
-                    probabilities = np.array(probabilities)
-                    probabilities = probabilities / probabilities.sum()
-                    # Invert the probabilities if needed
-                    if args.invert:
-                        probabilities = 1 / (probabilities + 1e-6 / len(probabilities))
-                        probabilities = probabilities / probabilities.sum()
+                while True:
+                    # Reweigh the elements the last batch changed
+                    log.debug(f"Reweighed {sampler.update()} elements")
 
                     # print words and probabilities sorted
-                    with open(path.join(root, "tmp.txt"), "w") as f:
-                        f.write(
-                            "\n".join(
-                                f"{x}: {p:.4e}"
-                                for x, p in sorted(
-                                    zip(elements, probabilities),
-                                    key=lambda x: x[1],
-                                    reverse=True,
+                    if args.dump_weights:
+                        with open(path.join(root, "tmp.txt"), "w") as f:
+                            f.write(
+                                "\n".join(
+                                    f"{x}: {p:.4e}" for x, p in sampler.probabilities()
                                 )
+                                + "\n"
                             )
-                            + "\n"
-                        )
 
                     # choose random elements
-                    a = np.random.choice(
-                        elements, size=args.batch, p=probabilities, replace=False
-                    ).tolist()
+                    a = sampler.sample(args.batch)
 
                     # Loop through all pairs of elements
                     insert_combination(
                         log,
-                        pool,
+                        engine,
                         args,
                         con,
                         cur,
+                        writer,
                         itertools.combinations_with_replacement(a, 2),
                     )
             elif args.algorithm == "explore":
-                # Get all elements
-                elements = cur.execute(
-                    f"""
-                    SELECT text FROM elements
-                        WHERE text <> 'Nothing'
-                        ORDER BY {args.key}
-                    """
-                ).fetchall()
-
-                elements = [x for x, in elements]
-
                 search_new = set()
 
                 # Make sure the elements exist
                 for element in search:
-                    if (
-                        cur.execute(
-                            "SELECT COUNT(*) FROM elements WHERE text = ?", (element,)
-                        ).fetchone()[0]
-                        == 0
-                    ):
+                    if not graph.has_element(element):
                         log.warn(f"Element {element} does not exist, skipping...")
                     else:
                         search_new.add(element)
                 search = search_new
 
-                batch = []
-                count = 0
-                for b in elements:
-                    count += 1
+                # Resume at the element the last crawl stopped on
+                start = None
+                state = None if args.no_resume else load_state(cur, "explore")
+                if (
+                    state is not None
+                    and state["key"] == args.key
+                    and state["search"] == sorted(search)
+                ):
+                    start = state["start"]
+                    log.info(f"Resuming explore at {start[1]}")
+
+                pairs = explore_pairs(cur, graph, args.key, search, start)
+                while True:
+                    batch = list(itertools.islice(pairs, args.batch))
+                    if len(batch) == 0:
+                        break
+
+                    insert_combination(
+                        log, engine, args, con, cur, writer, [x for x, _ in batch]
+                    )
+
+                    # Restart on the last element, its tried pairs are skipped
+                    save_state(
+                        cur,
+                        "explore",
+                        {
+                            "key": args.key,
+                            "search": sorted(search),
+                            "start": batch[-1][1],
+                        },
+                    )
+                    con.commit()
 
-                    if count % args.batch == 0:
-                        insert_combination(log, pool, args, con, cur, batch)
-                        batch = []
-                    batch += [(a, b) for a in search]
+                clear_state(cur, "explore")
+                con.commit()
+                log.info("Explored every element")
 
     except KeyboardInterrupt:
         log.info("Exiting...")
 
+        # Write out any results still waiting in the queue
+        writer.close()
         con.close()
         exit(0)
 
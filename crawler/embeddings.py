@@ -0,0 +1,195 @@
+import json
+import os
+from os import path
+
+import numpy as np
+
+# Word vector index over the element names, used by the find algorithm. Every
+# word of every element is stored as a normalized float32 row, tagged with the
+# element it belongs to, so similarities against a search term are one matrix
+# product. The index is cached to disk per model as append-only chunks, one
+# <start>.npy of vectors and one <start>.json of names and word counts each.
+
+
+# Normalized vectors of the words in text. Words missing from the model get a
+# zero vector, so their similarity to anything is 0.
+def word_vectors(model, text):
+    words = text.lower().split()
+    vectors = np.zeros((len(words), model.vector_size), dtype=np.float32)
+    for n, word in enumerate(words):
+        if word in model.key_to_index:
+            vectors[n] = model.get_vector(word, norm=True)
+    return vectors
+
+
+# Similarity of two texts given their word vectors: for each word of a take its
+# best cosine similarity with a word of b, then divide the l2 norm of those by
+# the product of the word counts
+def vector_similarity(a, b):
+    if len(a) == 0 or len(b) == 0:
+        return 0.0
+    best = (a @ b.T).max(axis=1)
+    return float(np.sqrt(best @ best) / (len(a) * len(b)))
+
+
+class EmbeddingIndex:
+    # Chunks are merged into one once there are more than this many
+    max_chunks = 16
+
+    def __init__(self, model, model_name, root=None):
+        self.model = model
+
+        if root is None:
+            root = path.join(path.dirname(path.abspath(__file__)), "embeddings")
+        self.dir = path.join(root, model_name)
+
+        self.names = []
+        self.ids = {}
+        # Element id of every row in vectors
+        self.owner = np.zeros(0, dtype=np.int64)
+        self.vectors = np.zeros((0, model.vector_size), dtype=np.float32)
+        # Number of words in every element
+        self.counts = np.zeros(0, dtype=np.int64)
+
+        # Elements already written to disk, and the chunks holding them
+        self.saved = 0
+        self.chunks = []
+
+        self.load()
+
+    def __len__(self):
+        return len(self.names)
+
+    def _chunk_path(self, start):
+        return path.join(self.dir, f"{start:09d}")
+
+    def load(self):
+        if not path.isdir(self.dir):
+            return
+
+        starts = sorted(
+            int(fname[:-5]) for fname in os.listdir(self.dir) if fname.endswith(".json")
+        )
+
+        names, counts, vectors = [], [], []
+        for start in starts:
+            fname = self._chunk_path(start)
+            with open(fname + ".json") as f:
+                chunk = json.load(f)
+            rows = np.load(fname + ".npy")
+
+            # Stop at a gap or a chunk from an interrupted save
+            if start != len(names) or len(rows) != sum(chunk["counts"]):
+                break
+
+            names.extend(chunk["names"])
+            counts.extend(chunk["counts"])
+            vectors.append(rows)
+            self.chunks.append(start)
+
+        if len(names) == 0:
+            return
+
+        self.names = names
+        self.ids = {text: i for i, text in enumerate(names)}
+        self.counts = np.array(counts, dtype=np.int64)
+        self.owner = np.repeat(np.arange(len(names)), self.counts)
+        self.vectors = np.concatenate(vectors)
+        self.saved = len(names)
+
+    def _write_chunk(self, start, end):
+        rows = self.owner >= start
+        rows &= self.owner < end
+
+        fname = self._chunk_path(start)
+        np.save(fname + ".npy", self.vectors[rows])
+        # The json is written last, so it marks the chunk as complete
+        with open(fname + ".json", "w") as f:
+            json.dump(
+                {
+                    "names": self.names[start:end],
+                    "counts": self.counts[start:end].tolist(),
+                },
+                f,
+            )
+
+    # Write the elements added since the last save as a new chunk
+    def save(self):
+        if self.saved == len(self.names):
+            return
+
+        os.makedirs(self.dir, exist_ok=True)
+
+        if len(self.chunks) >= self.max_chunks:
+            # Merge everything into a single chunk
+            self._write_chunk(0, len(self.names))
+            for start in self.chunks:
+                if start != 0:
+                    os.remove(self._chunk_path(start) + ".json")
+                    os.remove(self._chunk_path(start) + ".npy")
+            self.chunks = [0]
+        else:
+            self._write_chunk(self.saved, len(self.names))
+            self.chunks.append(self.saved)
+
+        self.saved = len(self.names)
+
+    def word_vectors(self, text):
+        return word_vectors(self.model, text)
+
+    # Add the elements that are not indexed yet. Returns how many were added.
+    def update(self, elements):
+        new = [text for text in elements if text not in self.ids]
+        if len(new) == 0:
+            return 0
+
+        start = len(self.names)
+        rows = [self.word_vectors(text) for text in new]
+
+        self.names.extend(new)
+        self.ids.update((text, start + n) for n, text in enumerate(new))
+        self.owner = np.concatenate(
+            [
+                self.owner,
+                np.repeat(
+                    np.arange(start, len(self.names)), [len(r) for r in rows]
+                ).astype(np.int64),
+            ]
+        )
+        self.vectors = np.concatenate([self.vectors, *rows])
+        self.counts = np.bincount(self.owner, minlength=len(self.names))
+
+        return len(new)
+
+    # Similarity of every indexed element to text, as in vector_similarity
+    def similarity(self, text):
+        search = self.word_vectors(text)
+        if len(search) == 0 or len(self.vectors) == 0:
+            return np.zeros(len(self.names), dtype=np.float32)
+
+        best = (self.vectors @ search.T).max(axis=1)
+        norms = np.sqrt(
+            np.bincount(self.owner, weights=best * best, minlength=len(self.names))
+        )
+
+        return (norms / np.maximum(self.counts * len(search), 1)).astype(np.float32)
+
+    # The k indexed elements most similar to any of the search terms, most
+    # similar first, out of the elements in candidates
+    def top_k(self, search, k, candidates=None):
+        scores = np.full(len(self.names), -np.inf, dtype=np.float32)
+        for text in search:
+            np.maximum(scores, self.similarity(text), out=scores)
+
+        if candidates is not None:
+            mask = np.zeros(len(self.names), dtype=bool)
+            mask[[self.ids[text] for text in candidates if text in self.ids]] = True
+            scores[~mask] = -np.inf
+
+        k = min(k, int(np.isfinite(scores).sum()))
+        if k == 0:
+            return []
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [self.names[i] for i in top]
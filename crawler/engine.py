@@ -0,0 +1,222 @@
+import asyncio
+import multiprocessing
+import time
+from collections import deque
+
+import aiohttp
+
+from utils import (
+    NegativeCacheHit,
+    PairError,
+    RateLimited,
+    async_insert_combination,
+    cache_fail,
+    cache_lookup,
+    cache_store,
+    headers,
+    pair_url,
+    parse_pair,
+)
+
+
+# Combines pairs by shipping them to a pool of worker processes, each of which
+# calls the blocking utils.combine. Submissions are paced by the shared rate
+# controller, and rate limited pairs are sent again once it allows.
+class PoolEngine:
+    def __init__(self, controller, processes=20, initializer=None, initargs=()):
+        self.controller = controller
+        self.pool = multiprocessing.Pool(processes, initializer, initargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.pool.terminate()
+
+    def combine_all(self, log, inputs, callback):
+        inputs = iter(inputs)
+        retry = deque()
+        results = []
+
+        def collect(r):
+            a, b, status, latency, res = r.get()
+            self.controller.release(status, latency)
+
+            if status == 429:
+                log.error(f"Rate limited {a} and {b}, retrying")
+                retry.append((a, b))
+            elif res is not None:
+                callback(*res)
+
+        try:
+            while True:
+                newres = []
+                for r in results:
+                    if not r.ready():
+                        newres.append(r)
+                    else:
+                        collect(r)
+                results = newres
+
+                if len(retry) > 0:
+                    pair = retry.popleft()
+                else:
+                    pair = next(inputs, None)
+
+                if pair is None:
+                    if len(results) == 0:
+                        break
+
+                    # Wait on outstanding requests, which may need a retry
+                    results[0].wait(0.1)
+                    continue
+
+                # Cached pairs never reach the network, so they neither wait
+                # for a rate slot nor count as requests
+                try:
+                    cached = cache_lookup(*pair)
+                except NegativeCacheHit as e:
+                    log.debug(f"Skipping {pair[0]} and {pair[1]}: {e}")
+                    continue
+                if cached is not None:
+                    callback(*pair, *cached)
+                    continue
+
+                self.controller.acquire()
+                results.append(
+                    self.pool.apply_async(
+                        async_insert_combination,
+                        args=(log, *pair),
+                    )
+                )
+        except KeyboardInterrupt:
+            log.error("Keyboard Interrupt")
+
+            # Keep the results that already came back from the network
+            for r in results:
+                if r.ready() and r.successful():
+                    collect(r)
+
+            self.pool.terminate()
+            raise
+
+        log.debug(self.controller.summary())
+
+
+# Combines pairs on a single event loop with one shared HTTP connection pool,
+# paced by the shared rate controller. Callbacks run on the loop thread, so
+# results are inserted one at a time.
+class AsyncEngine:
+    def __init__(self, log, controller, concurrency=100):
+        self.log = log
+        self.controller = controller
+        self.concurrency = concurrency
+        self.loop = asyncio.new_event_loop()
+        self.session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.loop.is_closed():
+            return
+
+        # Cancel anything left over from an interrupted batch
+        pending = asyncio.all_tasks(self.loop)
+        if pending:
+            for task in pending:
+                task.cancel()
+            self.loop.run_until_complete(
+                asyncio.wait(pending, return_when=asyncio.ALL_COMPLETED)
+            )
+
+        if self.session is not None:
+            self.loop.run_until_complete(self.session.close())
+        self.loop.close()
+
+    async def _get_session(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                headers=headers,
+                connector=aiohttp.TCPConnector(limit=self.concurrency),
+                timeout=aiohttp.ClientTimeout(total=30),
+            )
+        return self.session
+
+    async def combine(self, a, b):
+        result = cache_lookup(a, b)
+        if result is not None:
+            return result
+
+        session = await self._get_session()
+
+        # The wait takes an in-flight slot, so it has to be inside the try that
+        # gives it back, or a cancelled wait would leak the slot
+        t_start = time.time()
+        status = None
+        try:
+            await self.controller.wait()
+            t_start = time.time()
+            async with session.get(pair_url(a, b)) as r:
+                status = r.status
+                if r.status == 500:
+                    raise PairError("Internal Server Error")
+                elif r.status == 429:
+                    raise RateLimited("Rate Limited")
+                elif r.status == 403:
+                    raise Exception("Forbidden")
+                elif r.status != 200:
+                    raise PairError(r.status)
+                result = parse_pair(self.log, a, b, await r.text())
+        except PairError as e:
+            cache_fail(a, b, e)
+            raise
+        finally:
+            self.controller.release(status, time.time() - t_start)
+
+        cache_store(a, b, result)
+        return result
+
+    async def _run(self, inputs, callback):
+        inputs = iter(inputs)
+        # Rate limited pairs, sent again before any new pair once the
+        # controller allows
+        retry = deque()
+
+        def next_pair():
+            if len(retry) > 0:
+                return retry.popleft()
+            return next(inputs, None)
+
+        # A fixed number of workers pull from the shared iterator, so memory
+        # stays bounded no matter how many pairs are queued
+        async def worker():
+            while (pair := next_pair()) is not None:
+                a, b = pair
+                try:
+                    result, is_new, emoji = await self.combine(a, b)
+                except RateLimited:
+                    # The controller backs everyone off before the retry
+                    self.log.error(f"Rate limited {a} and {b}, retrying")
+                    retry.append((a, b))
+                    continue
+                except NegativeCacheHit as e:
+                    self.log.debug(f"Skipping {a} and {b}: {e}")
+                    continue
+                except Exception as e:
+                    self.log.error(f"Failed to combine {a} and {b}: {e}")
+                    continue
+
+                callback(a, b, result, is_new, emoji)
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+
+    def combine_all(self, log, inputs, callback):
+        self.loop.run_until_complete(self._run(inputs, callback))
+        log.debug(self.controller.summary())
@@ -0,0 +1,183 @@
+import json
+
+from graph import pack
+from utils import in_shard
+
+# Streaming pair generators for the crawl algorithms, plus the crawl_state
+# table used to persist their cursors so a restarted crawl resumes where it
+# stopped.
+
+
+def load_state(cur, name):
+    row = cur.execute(
+        "SELECT value FROM crawl_state WHERE name = ?", (name,)
+    ).fetchone()
+    return None if row is None else json.loads(row[0])
+
+
+def save_state(cur, name, value):
+    cur.execute(
+        """
+        INSERT INTO crawl_state VALUES (?, ?)
+            ON CONFLICT (name) DO UPDATE SET value = excluded.value
+        """,
+        (name, json.dumps(value)),
+    )
+
+
+def clear_state(cur, name):
+    cur.execute("DELETE FROM crawl_state WHERE name = ?", (name,))
+
+
+# Name of the bfs cursor in crawl_state, one per shard
+def bfs_state_name(shard):
+    return "bfs" if shard is None else f"bfs:{shard[0]}/{shard[1]}"
+
+
+# Lowest level any shard of a sharded bfs is on, or None if some shard has not
+# saved a cursor for this key and sort yet
+def slowest_shard(cur, key, sort, n):
+    levels = []
+    for i in range(n):
+        state = load_state(cur, bfs_state_name((i, n)))
+        if state is None or state["key"] != key or state["sort"] != sort:
+            return None
+        levels.append(state["idx"])
+    return min(levels)
+
+
+# Pairs of one bfs level: every element with key = idx combined with every
+# element with key <= idx. Pairs are generated lazily in (a, b) order, skipping
+# the ones the graph has already tried and the mirrored copy of pairs where
+# both elements are in the level. `after` is the last pair handled by an
+# earlier run, and iteration starts right after it. With a shard (i, N) only
+# the pairs hashing to that shard are generated.
+class BfsFrontier:
+    def __init__(self, cur, graph, key, sort, idx, after=None, shard=None):
+        self.graph = graph
+        self.idx = idx
+        self.shard = shard
+
+        self.delements = [
+            text
+            for text, in cur.execute(
+                f"SELECT text FROM elements WHERE {key} = ? AND text <> 'Nothing' ORDER BY {sort}",
+                (idx,),
+            )
+        ]
+        self.lelements = [
+            text
+            for text, in cur.execute(
+                f"SELECT text FROM elements WHERE {key} <= ? AND text <> 'Nothing' ORDER BY {sort}",
+                (idx,),
+            )
+        ]
+
+        self.total = len(self.delements) * len(self.lelements)
+        # Pairs walked over so far, tried or not
+        self.count = 0
+        self.after = after
+
+    def __iter__(self):
+        graph = self.graph
+
+        d_position = {text: n for n, text in enumerate(self.delements)}
+        l_position = {text: n for n, text in enumerate(self.lelements)}
+
+        start_a, start_b = 0, 0
+        if self.after is not None:
+            a, b = self.after
+            if a in d_position and b in l_position:
+                start_a = d_position[a]
+                start_b = l_position[b] + 1
+
+        self.count = start_a * len(self.lelements) + start_b
+
+        for n in range(start_a, len(self.delements)):
+            a = self.delements[n]
+            i = graph.id(a)
+
+            for m in range(start_b if n == start_a else 0, len(self.lelements)):
+                b = self.lelements[m]
+                self.count += 1
+
+                # Pairs inside the level are only generated once
+                if d_position.get(b, n) < n:
+                    continue
+
+                if pack(i, graph.id(b)) in graph.recipes:
+                    continue
+
+                if self.shard is not None and not in_shard(a, b, self.shard):
+                    continue
+
+                yield a, b
+
+
+# Elements as (key value, text) in ORDER BY key, text order, read a page at a
+# time with keyset pagination. Iteration starts at the element `start`,
+# inclusive, or at the beginning.
+def keyset_elements(cur, key, start=None, page_size=1000):
+    # NULLs sort first, and row values never compare equal to NULL, so the
+    # elements without a value are paged by text on their own
+    if start is None or start[0] is None:
+        text = "" if start is None else start[1]
+        op = ">="
+        while True:
+            rows = cur.execute(
+                f"""
+                SELECT {key}, text FROM elements
+                    WHERE {key} IS NULL AND text {op} ? AND text <> 'Nothing'
+                    ORDER BY text LIMIT ?
+                """,
+                (text, page_size),
+            ).fetchall()
+            yield from rows
+
+            if len(rows) < page_size:
+                break
+            text = rows[-1][1]
+            op = ">"
+
+        start = None
+    else:
+        op = ">="
+
+    while True:
+        if start is None:
+            rows = cur.execute(
+                f"""
+                SELECT {key}, text FROM elements
+                    WHERE {key} IS NOT NULL AND text <> 'Nothing'
+                    ORDER BY {key}, text LIMIT ?
+                """,
+                (page_size,),
+            ).fetchall()
+        else:
+            rows = cur.execute(
+                f"""
+                SELECT {key}, text FROM elements
+                    WHERE ({key}, text) {op} (?, ?) AND text <> 'Nothing'
+                    ORDER BY {key}, text LIMIT ?
+                """,
+                (*start, page_size),
+            ).fetchall()
+        yield from rows
+
+        if len(rows) < page_size:
+            break
+        start = rows[-1]
+        op = ">"
+
+
+# Pairs of every element with each of the search elements, in keyset order,
+# skipping the pairs the graph has already tried. Yields the pair and the
+# (key value, text) position of its element, to resume from.
+def explore_pairs(cur, graph, key, search, start=None, page_size=1000):
+    search = sorted(search)
+
+    for position in keyset_elements(cur, key, start, page_size):
+        b = position[1]
+        for a in search:
+            if not graph.is_tried(a, b):
+                yield (a, b), position
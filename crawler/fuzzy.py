@@ -0,0 +1,100 @@
+import re
+from collections import Counter
+
+from fuzzywuzzy import fuzz, process
+
+from frontier import load_state, save_state
+
+# Fuzzy element lookup for "did you mean" suggestions. Elements are indexed by
+# their lowercase words and character trigrams in the element_words and
+# element_trigrams tables, so only a shortlist of elements sharing grams with
+# the query is scored with fuzzywuzzy. The index catches up on new elements by
+# rowid before every lookup.
+
+
+def words(text):
+    return set(re.findall(r"\w+", text.lower()))
+
+
+# Trigrams of each word, padded so short words and word starts get grams too
+def trigrams(text):
+    grams = set()
+    for word in words(text):
+        padded = f"  {word} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class FuzzyIndex:
+    # A shared word counts for this many shared trigrams
+    word_weight = 3
+
+    def __init__(self, con, max_postings=5000, batch_size=10_000):
+        self.con = con
+        self.cur = con.cursor()
+        # Elements read per gram, very common grams are cut off here
+        self.max_postings = max_postings
+        self.batch_size = batch_size
+
+    # Index the elements added since the last update
+    def update(self):
+        cur = self.cur
+        state = load_state(cur, "fuzzy_index") or {"rowid": 0}
+
+        n = 0
+        while True:
+            rows = cur.execute(
+                "SELECT rowid, text FROM elements WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (state["rowid"], self.batch_size),
+            ).fetchall()
+            if len(rows) == 0:
+                break
+
+            # Inserting in key order keeps the b-tree writes local
+            cur.executemany(
+                "INSERT OR IGNORE INTO element_words VALUES (?, ?)",
+                sorted((word, text) for _, text in rows for word in words(text)),
+            )
+            cur.executemany(
+                "INSERT OR IGNORE INTO element_trigrams VALUES (?, ?)",
+                sorted((gram, text) for _, text in rows for gram in trigrams(text)),
+            )
+
+            state["rowid"] = rows[-1][0]
+            save_state(cur, "fuzzy_index", state)
+            self.con.commit()
+            n += len(rows)
+
+        return n
+
+    # Elements sharing the most words and trigrams with the query
+    def candidates(self, query, limit=100):
+        cur = self.cur
+        counts = Counter()
+
+        for word in words(query):
+            for (text,) in cur.execute(
+                "SELECT text FROM element_words WHERE word = ? LIMIT ?",
+                (word, self.max_postings),
+            ):
+                counts[text] += self.word_weight
+
+        for gram in trigrams(query):
+            for (text,) in cur.execute(
+                "SELECT text FROM element_trigrams WHERE trigram = ? LIMIT ?",
+                (gram, self.max_postings),
+            ):
+                counts[text] += 1
+
+        return [text for text, _ in counts.most_common(limit)]
+
+    # The k best matches for the query as (element, score), scored with the
+    # same token_set_ratio as a full scan
+    def suggest(self, query, k=5, shortlist=300):
+        self.update()
+        return process.extract(
+            query,
+            self.candidates(query, shortlist),
+            limit=k,
+            scorer=fuzz.token_set_ratio,
+        )
@@ -0,0 +1,249 @@
+# In-memory index of the elements and recipes tables, so the crawler's hot
+# paths can answer lookups without a round trip to SQLite. Elements are
+# interned to compact integer ids and pairs are packed into a single int.
+
+
+def pack(i, j):
+    if i > j:
+        i, j = j, i
+    return (i << 32) | j
+
+
+def unpack(key):
+    return key >> 32, key & 0xFFFFFFFF
+
+
+class RecipeGraph:
+    def __init__(self, cur=None):
+        # Set of ids whose stats changed, recorded once a consumer sets it
+        self.changed = None
+        self.reload(cur)
+
+    def _mark(self, i):
+        if self.changed is not None:
+            self.changed.add(i)
+
+    def reload(self, cur=None):
+        # text -> id and id -> text
+        self.ids = {}
+        self.names = []
+
+        # Whether the id is a row in the elements table, or has only been seen
+        # as part of a recipe
+        self.exists = bytearray()
+
+        # Per-element stats, indexed by id
+        self.depth = []
+        self.yields = []
+        self.recipe_count = []
+        self.freq = []
+
+        # Packed input pair -> output id, doubling as the set of tried pairs
+        self.recipes = {}
+        # id -> ids it has been combined with
+        self.by_input = []
+        # id -> packed input pairs that create it
+        self.by_output = []
+        # Packed (input, output) pairs, used to keep yield up to date
+        self.products = set()
+
+        # Highest rowids loaded, so sync can pick up rows written by others
+        self.last_element = 0
+        self.last_recipe = 0
+
+        if cur is None:
+            return
+
+        for rowid, text, depth, y, r, f in cur.execute(
+            "SELECT rowid, text, depth, yield, recipe_count, freq FROM elements"
+        ):
+            self._load_element(text, depth, y, r, f)
+            self.last_element = max(self.last_element, rowid)
+
+        for rowid, a, b, output in cur.execute(
+            "SELECT rowid, input1, input2, output FROM recipes"
+        ):
+            self.add_recipe(a, b, output)
+            self.last_recipe = max(self.last_recipe, rowid)
+
+    def _load_element(self, text, depth, y, r, f):
+        i = self.id(text)
+        self._mark(i)
+        self.exists[i] = 1
+        self.depth[i] = depth
+        self.yields[i] = y or 0
+        self.recipe_count[i] = r or 0
+        self.freq[i] = f or 0
+
+    # Pick up the rows other processes committed since the graph was loaded.
+    # New recipes are added and the stats of every element they touch are read
+    # again. Depth changes are followed through the recipes using the changed
+    # elements, since the other process may have lowered their outputs too.
+    # Returns the number of elements refreshed.
+    def sync(self, cur):
+        touched = set()
+
+        for rowid, a, b, output in cur.execute(
+            "SELECT rowid, input1, input2, output FROM recipes WHERE rowid > ?",
+            (self.last_recipe,),
+        ).fetchall():
+            self.add_recipe(a, b, output)
+            self.last_recipe = max(self.last_recipe, rowid)
+            touched.update((a, b, output))
+
+        for rowid, text in cur.execute(
+            "SELECT rowid, text FROM elements WHERE rowid > ?", (self.last_element,)
+        ).fetchall():
+            self.last_element = max(self.last_element, rowid)
+            touched.add(text)
+
+        touched = list(touched)
+        changed = []
+        for n in range(0, len(touched), 500):
+            chunk = touched[n : n + 500]
+            for row in cur.execute(
+                f"""
+                SELECT text, depth, yield, recipe_count, freq FROM elements
+                    WHERE text IN ({', '.join('?' * len(chunk))})
+                """,
+                chunk,
+            ).fetchall():
+                if self.get_depth(row[0]) != row[1]:
+                    changed.append(row[0])
+                self._load_element(*row)
+
+        refreshed = len(touched)
+        while len(changed) > 0:
+            x = changed.pop()
+            for _, output in self.uses(x):
+                row = cur.execute(
+                    "SELECT depth FROM elements WHERE text = ?", (output,)
+                ).fetchone()
+                if row is not None and self.get_depth(output) != row[0]:
+                    self.set_depth(output, row[0])
+                    changed.append(output)
+                    refreshed += 1
+
+        return refreshed
+
+    def reload_depths(self, cur):
+        for text, depth in cur.execute("SELECT text, depth FROM elements"):
+            self.set_depth(text, depth)
+
+    def __len__(self):
+        return len(self.names)
+
+    # Get the id of an element, interning it if it has not been seen yet
+    def id(self, text):
+        i = self.ids.get(text)
+        if i is None:
+            i = len(self.names)
+            self.ids[text] = i
+            self.names.append(text)
+            self.exists.append(0)
+            self.depth.append(None)
+            self.yields.append(0)
+            self.recipe_count.append(0)
+            self.freq.append(0)
+            self.by_input.append([])
+            self.by_output.append([])
+        return i
+
+    def has_element(self, text):
+        i = self.ids.get(text)
+        return i is not None and self.exists[i] == 1
+
+    def add_element(self, text, depth):
+        i = self.id(text)
+        self._mark(i)
+        self.exists[i] = 1
+        self.depth[i] = depth
+        return i
+
+    def get_depth(self, text):
+        i = self.ids.get(text)
+        return None if i is None else self.depth[i]
+
+    def set_depth(self, text, depth):
+        i = self.id(text)
+        self._mark(i)
+        self.depth[i] = depth
+
+    def is_tried(self, a, b):
+        i = self.ids.get(a)
+        j = self.ids.get(b)
+        if i is None or j is None:
+            return False
+        return pack(i, j) in self.recipes
+
+    # Get the output of a pair, or None if it has not been tried
+    def output(self, a, b):
+        i = self.ids.get(a)
+        j = self.ids.get(b)
+        if i is None or j is None:
+            return None
+        o = self.recipes.get(pack(i, j))
+        return None if o is None else self.names[o]
+
+    # Record a recipe. Returns the set of inputs that had not created the
+    # output before, or None if the pair was already recorded.
+    def add_recipe(self, a, b, output):
+        i = self.id(a)
+        j = self.id(b)
+        o = self.id(output)
+
+        key = pack(i, j)
+        if key in self.recipes:
+            return None
+
+        self.recipes[key] = o
+        self.by_input[i].append(j)
+        if i != j:
+            self.by_input[j].append(i)
+        self.by_output[o].append(key)
+
+        new_products = set()
+        for x in (i, j):
+            product = (x << 32) | o
+            if product not in self.products:
+                self.products.add(product)
+                new_products.add(self.names[x])
+        return new_products
+
+    # Names of the elements that have been combined with a
+    def partners(self, a):
+        i = self.ids.get(a)
+        if i is None:
+            return set()
+        return {self.names[j] for j in self.by_input[i]}
+
+    # (other input, output) of every recipe using the element
+    def uses(self, a):
+        i = self.ids.get(a)
+        if i is None:
+            return []
+        return [
+            (self.names[j], self.names[self.recipes[pack(i, j)]])
+            for j in self.by_input[i]
+        ]
+
+    # Input pairs that create the element
+    def creators(self, output):
+        o = self.ids.get(output)
+        if o is None:
+            return []
+        return [
+            (self.names[i], self.names[j])
+            for i, j in (unpack(key) for key in self.by_output[o])
+        ]
+
+    def apply_counters(self, counters):
+        for column, values in (
+            ("recipe_count", self.recipe_count),
+            ("yield", self.yields),
+            ("freq", self.freq),
+        ):
+            for text, n in counters[column].items():
+                i = self.id(text)
+                self._mark(i)
+                values[i] += n
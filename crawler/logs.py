@@ -0,0 +1,126 @@
+import json
+import logging
+import os
+import time
+from logging.handlers import QueueHandler
+
+# Logging helpers for the crawler's hot paths. Records are handed to a
+# QueueListener thread unformatted, so formatting and the blocking writes to
+# stderr happen off the thread inserting recipes.
+#
+# Recipe records carry an `event` attribute, "recipe" for every recipe and
+# "discovery" for new elements, with the recipe itself in `recipe`.
+
+
+# Queue handler that leaves the formatting to the listener. A forked pool
+# worker has no listener thread, so it writes through the fallback handler.
+class LocalQueueHandler(QueueHandler):
+    def __init__(self, queue, fallback):
+        super().__init__(queue)
+        self.fallback = fallback
+        self.pid = os.getpid()
+
+    def prepare(self, record):
+        return record
+
+    def emit(self, record):
+        if os.getpid() != self.pid:
+            self.fallback.handle(record)
+            return
+        super().emit(record)
+
+
+# Counts recipe records instead of printing them, and prints a summary line
+# at most once every interval seconds
+class SummaryHandler(logging.Handler):
+    def __init__(self, target, interval):
+        super().__init__()
+        self.target = target
+        self.interval = interval
+        self.recipes = 0
+        self.discoveries = 0
+        self.last = time.monotonic()
+
+    def emit(self, record):
+        event = getattr(record, "event", None)
+        if event == "recipe":
+            self.recipes += 1
+        else:
+            if event == "discovery":
+                self.recipes += 1
+                self.discoveries += 1
+            self.target.handle(record)
+
+        if time.monotonic() - self.last >= self.interval:
+            self.summarize()
+
+    def summarize(self):
+        now = time.monotonic()
+        elapsed = max(now - self.last, 1e-9)
+
+        if self.recipes > 0:
+            self.target.handle(
+                logging.makeLogRecord(
+                    {
+                        "name": "summary",
+                        "levelno": logging.INFO,
+                        "levelname": logging.getLevelName(logging.INFO),
+                        "msg": "Recorded %d recipes (%.1f/s) and %d new elements in %.1fs",
+                        "args": (
+                            self.recipes,
+                            self.recipes / elapsed,
+                            self.discoveries,
+                            elapsed,
+                        ),
+                    }
+                )
+            )
+
+        self.recipes = 0
+        self.discoveries = 0
+        self.last = now
+
+    def close(self):
+        self.summarize()
+        self.target.close()
+        super().close()
+
+
+# Appends every discovery to a JSONL file, one object per line
+class EventLogHandler(logging.Handler):
+    def __init__(self, fname, flush_interval=1.0):
+        super().__init__()
+        self.file = open(fname, "a", encoding="utf-8")
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+
+    def emit(self, record):
+        if getattr(record, "event", None) != "discovery":
+            return
+
+        a, b, result, emoji, is_new = record.recipe
+        self.file.write(
+            json.dumps(
+                {
+                    "time": record.created,
+                    "input1": a,
+                    "input2": b,
+                    "result": result,
+                    "emoji": emoji,
+                    "first_discovery": bool(is_new),
+                },
+                ensure_ascii=False,
+            )
+            + "\n"
+        )
+
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.file.flush()
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.file.close()
+        super().close()
@@ -1,67 +1,171 @@
 import sqlite3
-import json
-from utils import recalculate_depth_tree, norm_recipe, recalculate_yield
+import argparse
+import ijson
+from itertools import islice
+from utils import (
+    norm_recipe,
+    recalculate_depth_tree,
+    recalculate_shortest_path,
+    recalculate_yield,
+    update_depth,
+)
 from os import path
+from migrations import migrate
+
+# Merges an Infinite Craft save file into the database. The file is streamed
+# with ijson in two passes, elements then recipes, and written in large
+# executemany batches, so memory stays bounded however big the save is.
 
 root = path.dirname(__file__)
 
-con = sqlite3.connect(path.join(root, "infinite_craft.db"))
-cur = con.cursor()
-
-# Enable foreign keys
-cur.execute("PRAGMA foreign_keys = ON")
-
-cur.execute(
-    """
-      CREATE TABLE IF NOT EXISTS elements (
-        text TEXT PRIMARY KEY,
-        emoji TEXT,
-        discovered BOOLEAN,
-        depth INTEGER,
-        yield INTEGER,
-        recipe_count INTEGER
-      )
-    """
-)
 
-cur.execute(
-    """ CREATE TABLE IF NOT EXISTS recipes (
-          input1 TEXT,
-          input2 TEXT,
-          output TEXT,
-          PRIMARY KEY (input1, input2),
-          FOREIGN KEY (input1) REFERENCES elements(text),
-          FOREIGN KEY (input2) REFERENCES elements(text),
-          FOREIGN KEY (output) REFERENCES elements(text)
-        )"""
-)
+def batches(rows, size):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+def read_elements(fname):
+    with open(fname, "rb") as f:
+        for element in ijson.items(f, "elements.item"):
+            yield element["text"], element.get("emoji"), element.get("discovered")
+
+
+def read_recipes(fname):
+    with open(fname, "rb") as f:
+        for output, recipes in ijson.kvitems(f, "recipes"):
+            for recipe in recipes:
+                yield (*norm_recipe(recipe[0]["text"], recipe[1]["text"]), output)
+
+
+def import_save(con, cur, fname, batch_size=100_000):
+    last_element = cur.execute("SELECT COALESCE(MAX(rowid), 0) FROM elements")
+    last_element = last_element.fetchone()[0]
+    last_recipe = cur.execute("SELECT COALESCE(MAX(rowid), 0) FROM recipes")
+    last_recipe = last_recipe.fetchone()[0]
+
+    # Insert elements, new ones start with empty stats
+    for batch in batches(read_elements(fname), batch_size):
+        cur.executemany(
+            "INSERT OR IGNORE INTO elements VALUES (?, ?, ?, NULL, 0, 0, 0)", batch
+        )
+        con.commit()
+
+    # Insert recipes, skipping the ones whose elements are missing instead of
+    # failing the batch on the foreign keys
+    total = 0
+    for batch in batches(read_recipes(fname), batch_size):
+        cur.executemany(
+            """
+            INSERT OR IGNORE INTO recipes (input1, input2, output)
+            SELECT ?1, ?2, ?3
+            WHERE EXISTS (SELECT 1 FROM elements WHERE text = ?1)
+                AND EXISTS (SELECT 1 FROM elements WHERE text = ?2)
+                AND EXISTS (SELECT 1 FROM elements WHERE text = ?3)
+            """,
+            batch,
+        )
+        con.commit()
+        total += len(batch)
+
+    new_elements = cur.execute(
+        "SELECT COUNT(*) FROM elements WHERE rowid > ?", (last_element,)
+    ).fetchone()[0]
+    new_recipes = cur.execute(
+        "SELECT COUNT(*) FROM recipes WHERE rowid > ?", (last_recipe,)
+    ).fetchone()[0]
+    print(f"Read {total} recipes: {new_recipes} new, {new_elements} new elements")
+    if total > new_recipes:
+        print(f"Skipped {total - new_recipes} known or invalid recipes")
+
+    return last_recipe, new_recipes
 
-# Load JSON data
-with open(path.join(root, "infinitecraft.json"), "r") as f:
-    data = json.load(f)
 
-# Insert elements
-for element in data["elements"]:
+# Bring the depths, shortest paths and stats up to date with the recipes
+# added after last_recipe
+def update_stats(con, cur, last_recipe, new_recipes):
+    if new_recipes == 0:
+        return
+
+    total = cur.execute("SELECT COUNT(*) FROM recipes").fetchone()[0]
+    if new_recipes > total // 4:
+        # Most of the tree is new, rebuilding it is cheaper
+        recalculate_depth_tree(con, cur)
+        recalculate_shortest_path(con, cur)
+    else:
+        for a, b, output in cur.execute(
+            "SELECT input1, input2, output FROM recipes WHERE rowid > ?",
+            (last_recipe,),
+        ).fetchall():
+            if output == "Nothing":
+                continue
+            d1, d2 = (
+                cur.execute(
+                    "SELECT depth FROM elements WHERE text = ?", (text,)
+                ).fetchone()[0]
+                for text in (a, b)
+            )
+            if d1 is not None and d2 is not None:
+                update_depth(cur, a, b, output, max(d1, d2) + 1)
+        con.commit()
+
+    # Only the elements of the new recipes have new stats
+    cur.execute("DROP TABLE IF EXISTS temp.affected")
+    cur.execute("CREATE TEMP TABLE affected (text TEXT PRIMARY KEY)")
     cur.execute(
-        "INSERT OR IGNORE INTO elements (text, emoji, discovered) VALUES (?, ?, ?)",
-        (element["text"], element["emoji"], element["discovered"]),
+        """
+        INSERT OR IGNORE INTO affected
+        SELECT input1 FROM recipes WHERE rowid > ?1
+        UNION SELECT input2 FROM recipes WHERE rowid > ?1
+        UNION SELECT output FROM recipes WHERE rowid > ?1
+        """,
+        (last_recipe,),
     )
+    recalculate_yield(con, cur, "affected")
+    cur.execute("DROP TABLE affected")
 
-# Insert recipes
-for output, recipes in data["recipes"].items():
-    for recipe in recipes:
-        r = norm_recipe(recipe[0]["text"], recipe[1]["text"])
-        try:
-            cur.execute(
-                "INSERT OR IGNORE INTO recipes (input1, input2, output) VALUES (?, ?, ?)",
-                (*r, output),
-            )
-        except sqlite3.IntegrityError as e:
-            print(e)
-            print(f"Invalid recipe: {r[0]} + {r[1]} = {output}")
 
-recalculate_depth_tree(con, cur)
-recalculate_yield(con, cur)
-con.commit()
+def main():
+    parser = argparse.ArgumentParser(description="Merge a save file into the database")
+    parser.add_argument(
+        "file",
+        nargs="?",
+        default=path.join(root, "infinitecraft.json"),
+        help="Save file to merge",
+    )
+    parser.add_argument(
+        "--db",
+        default=path.join(root, "infinite_craft.db"),
+        help="Database to merge into",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=100_000, help="Rows per transaction"
+    )
+    args = parser.parse_args()
+
+    con = sqlite3.connect(args.db)
+    cur = con.cursor()
+
+    migrate(con)
+
+    # Import settings: no fsync per transaction and a 256 MB page cache. The
+    # journal mode is restored afterwards.
+    journal_mode = cur.execute("PRAGMA journal_mode").fetchone()[0]
+    cur.execute("PRAGMA journal_mode = WAL")
+    cur.execute("PRAGMA synchronous = OFF")
+    cur.execute("PRAGMA cache_size = -262144")
+    cur.execute("PRAGMA temp_store = MEMORY")
+
+    last_recipe, new_recipes = import_save(con, cur, args.file, args.batch_size)
+    update_stats(con, cur, last_recipe, new_recipes)
+    con.commit()
+
+    cur.execute("PRAGMA synchronous = FULL")
+    cur.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    cur.execute(f"PRAGMA journal_mode = {journal_mode}")
+
+    con.close()
+
 
-con.close()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Crawler metrics. Counters, gauges and histograms live in a registry that can
+# be scraped in the Prometheus text format from a local /metrics endpoint, or
+# written out as periodic JSON snapshots.
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, registry, name, description, labels=()):
+        self.registry = registry
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        # Label values -> value
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def _label_str(self, key, extra=()):
+        pairs = [*zip(self.labels, key), *extra]
+        if len(pairs) == 0:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        for key, value in self.values.items():
+            yield f"{self.name}{self._label_str(key)} {value}"
+
+    def snapshot(self):
+        return {",".join(key): value for key, value in self.values.items()}
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name, description, labels=(), buckets=()):
+        super().__init__(registry, name, description, labels)
+        self.buckets = sorted(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = {
+                    "buckets": [0] * len(self.buckets),
+                    "sum": 0.0,
+                    "count": 0,
+                }
+
+            for n, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry["buckets"][n] += 1
+                    break
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def render(self):
+        for key, entry in self.values.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets, entry["buckets"]):
+                cumulative += n
+                yield f"{self.name}_bucket{self._label_str(key, [('le', bound)])} {cumulative}"
+            yield f"{self.name}_bucket{self._label_str(key, [('le', '+Inf')])} {entry['count']}"
+            yield f"{self.name}_sum{self._label_str(key)} {entry['sum']}"
+            yield f"{self.name}_count{self._label_str(key)} {entry['count']}"
+
+    def snapshot(self):
+        return {
+            ",".join(key): {
+                "buckets": dict(zip(map(str, self.buckets), entry["buckets"])),
+                "sum": entry["sum"],
+                "count": entry["count"],
+            }
+            for key, entry in self.values.items()
+        }
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+        # Counter totals at the last snapshot, for per second rates
+        self.last_snapshot = None
+
+    def counter(self, name, description, labels=()):
+        metric = Counter(self, name, description, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, description, labels=()):
+        metric = Gauge(self, name, description, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, description, labels=(), buckets=()):
+        metric = Histogram(self, name, description, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    # The Prometheus text exposition format
+    def render(self):
+        lines = []
+        with self.lock:
+            for metric in self.metrics:
+                lines.append(f"# HELP {metric.name} {metric.description}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        now = time.time()
+        with self.lock:
+            values = {metric.name: metric.snapshot() for metric in self.metrics}
+
+        # Counters also get their rate since the previous snapshot
+        rates = {}
+        if self.last_snapshot is not None:
+            last_time, last_values = self.last_snapshot
+            elapsed = max(now - last_time, 1e-9)
+            for metric in self.metrics:
+                if metric.kind != "counter":
+                    continue
+                previous = last_values.get(metric.name, {})
+                rates[metric.name] = {
+                    key: (value - previous.get(key, 0)) / elapsed
+                    for key, value in values[metric.name].items()
+                }
+        self.last_snapshot = (now, values)
+
+        return {"time": now, "metrics": values, "per_second": rates}
+
+    # Serve /metrics from a background thread
+    def serve(self, port, host="127.0.0.1"):
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    # Write a JSON snapshot to fname every interval seconds from a background
+    # thread. The file is replaced atomically, so readers never see half of it.
+    def write_snapshots(self, fname, interval=60.0):
+        def run():
+            while True:
+                time.sleep(interval)
+                tmp = fname + ".tmp"
+                with open(tmp, "w") as f:
+                    json.dump(self.snapshot(), f, indent=2)
+                os.replace(tmp, fname)
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+registry = Registry()
+
+latency_buckets = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+requests = registry.counter(
+    "crawler_requests_total", "Combine requests by HTTP status", ["status"]
+)
+request_seconds = registry.histogram(
+    "crawler_request_seconds",
+    "Combine request latency by HTTP status",
+    ["status"],
+    latency_buckets,
+)
+retries = registry.counter(
+    "crawler_retries_total", "Requests sent again after being rate limited"
+)
+backoff_seconds = registry.counter(
+    "crawler_backoff_seconds_total", "Seconds every request was paused after a 429"
+)
+rate = registry.gauge(
+    "crawler_rate", "Requests per second allowed by the rate controller"
+)
+in_flight = registry.gauge("crawler_in_flight", "Requests sent and not answered yet")
+
+db_write_seconds = registry.histogram(
+    "crawler_db_write_seconds",
+    "Time to apply and commit a batch of results",
+    buckets=[0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0],
+)
+write_queue = registry.gauge(
+    "crawler_write_queue", "Results waiting to be written to the database"
+)
+recipes = registry.counter("crawler_recipes_total", "New recipes recorded")
+new_elements = registry.counter(
+    "crawler_new_elements_total", "Elements discovered", ["first_discovery"]
+)
+pairs = registry.gauge(
+    "crawler_pairs", "Pairs walked and total pairs of the current level", ["state"]
+)
@@ -0,0 +1,209 @@
+import time
+
+# ANSI escape codes for color
+green = "\033[1;32m"
+purple = "\033[1;35m"
+reset = "\033[1;0m"
+
+# Versioned schema migrations. The schema version is stored in the database's
+# user_version, and each migration upgrades it by one.
+
+
+def _base_tables(cur):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS elements (
+            text TEXT PRIMARY KEY,
+            emoji TEXT,
+            discovered BOOLEAN,
+            depth INTEGER,
+            yield INTEGER,
+            recipe_count INTEGER,
+            freq INTEGER
+        )
+        """
+    )
+
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS recipes (
+            input1 TEXT,
+            input2 TEXT,
+            output TEXT,
+            PRIMARY KEY (input1, input2),
+            FOREIGN KEY (input1) REFERENCES elements(text),
+            FOREIGN KEY (input2) REFERENCES elements(text),
+            FOREIGN KEY (output) REFERENCES elements(text)
+        )
+        """
+    )
+
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS shortest_path (
+            output TEXT,
+            input1 TEXT,
+            input2 TEXT,
+            PRIMARY KEY (output),
+            FOREIGN KEY (input1) REFERENCES elements(text),
+            FOREIGN KEY (input2) REFERENCES elements(text),
+            FOREIGN KEY (output) REFERENCES elements(text)
+        )
+        """
+    )
+
+
+# Databases created by older versions of merge.py have no freq column
+def _add_freq(cur):
+    columns = [row[1] for row in cur.execute("PRAGMA table_info(elements)")]
+    if "freq" not in columns:
+        cur.execute("ALTER TABLE elements ADD COLUMN freq INTEGER DEFAULT 0")
+        cur.execute("UPDATE elements SET freq = 0")
+
+
+def _indexes(cur):
+    # The primary key covers lookups on input1, these cover the rest of the
+    # WHERE output = ? and WHERE input1 = ? OR input2 = ? lookups
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS recipes_output ON recipes (output, input1, input2)"
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS recipes_input2 ON recipes (input2, input1, output)"
+    )
+
+    cur.execute("CREATE INDEX IF NOT EXISTS elements_depth ON elements (depth)")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS elements_recipe_count ON elements (recipe_count)"
+    )
+
+    cur.execute("ANALYZE")
+
+
+# Key/value store for crawler progress, such as the bfs frontier cursor
+def _crawl_state(cur):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS crawl_state (
+            name TEXT PRIMARY KEY,
+            value TEXT
+        )
+        """
+    )
+
+
+# Keyset pagination orders by (depth, text), which the depth index alone
+# can't serve without sorting every remaining row
+def _depth_text_index(cur):
+    cur.execute("DROP INDEX IF EXISTS elements_depth")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS elements_depth_text ON elements (depth, text)"
+    )
+
+
+# Inverted index from lowercase words and character trigrams to elements, for
+# fuzzy element lookup. Filled in by fuzzy.FuzzyIndex.
+def _fuzzy_index(cur):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS element_words (
+            word TEXT,
+            text TEXT,
+            PRIMARY KEY (word, text)
+        ) WITHOUT ROWID
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS element_trigrams (
+            trigram TEXT,
+            text TEXT,
+            PRIMARY KEY (trigram, text)
+        ) WITHOUT ROWID
+        """
+    )
+
+
+migrations = [
+    _base_tables,
+    _add_freq,
+    _indexes,
+    _crawl_state,
+    _depth_text_index,
+    _fuzzy_index,
+]
+
+
+# Time the hot lookups against the element with the most recipes
+def _time_queries(cur):
+    row = cur.execute(
+        "SELECT text, depth FROM elements ORDER BY recipe_count DESC LIMIT 1"
+    ).fetchone()
+    if row is None:
+        return {}
+
+    element, depth = row
+
+    queries = {
+        "recipes by output": (
+            "SELECT input1, input2 FROM recipes WHERE output = ?",
+            (element,),
+        ),
+        "recipes by input": (
+            "SELECT input1, input2, output FROM recipes WHERE input1 = ? OR input2 = ?",
+            (element, element),
+        ),
+        "elements by depth": (
+            "SELECT text FROM elements WHERE depth = ?",
+            (depth,),
+        ),
+        "elements by recipe count": (
+            "SELECT text FROM elements WHERE recipe_count < ?",
+            (1,),
+        ),
+    }
+
+    timings = {}
+    for name, (query, params) in queries.items():
+        t_start = time.perf_counter()
+        cur.execute(query, params).fetchall()
+        timings[name] = time.perf_counter() - t_start
+
+    return timings
+
+
+def schema_version(cur):
+    return cur.execute("PRAGMA user_version").fetchone()[0]
+
+
+# Bring the database up to the latest schema version, reporting how long the
+# hot queries took before and after
+def migrate(con):
+    cur = con.cursor()
+
+    version = schema_version(cur)
+    if version >= len(migrations):
+        return
+
+    has_tables = (
+        cur.execute(
+            """
+            SELECT COUNT(*) FROM sqlite_master
+                WHERE type = 'table' AND name IN ('elements', 'recipes')
+            """
+        ).fetchone()[0]
+        == 2
+    )
+    before = _time_queries(cur) if has_tables else {}
+
+    for i in range(version, len(migrations)):
+        print(f"{purple}Migrating database to version {i + 1}{reset}")
+        migrations[i](cur)
+        cur.execute(f"PRAGMA user_version = {i + 1}")
+        con.commit()
+
+    after = _time_queries(cur)
+
+    for name, t in before.items():
+        print(
+            f"{green}{name}:{reset} {t * 1000:.2f}ms -> {after[name] * 1000:.2f}ms ({t / max(after[name], 1e-9):.1f}x)"
+        )
@@ -0,0 +1,135 @@
+import asyncio
+import threading
+import time
+from collections import deque
+
+import metrics
+
+
+# Request rate controller shared by every request the crawler sends.
+#
+# Requests are paced by a token bucket whose refill rate is adjusted with AIMD:
+# each healthy response adds increase / rate, so the rate grows by roughly
+# `increase` requests per second every second, while a 429 (or a response
+# slower than latency_target) multiplies the rate by `decrease`. A 429 also
+# pauses every request for `backoff` seconds.
+class RateController:
+    def __init__(
+        self,
+        rate=9.0,
+        min_rate=0.5,
+        max_rate=50.0,
+        increase=0.1,
+        decrease=0.5,
+        backoff=30.0,
+        burst=1.0,
+        latency_target=None,
+    ):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.backoff = backoff
+        self.burst = burst
+        self.latency_target = latency_target
+
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.backoff_until = 0.0
+        self.in_flight = 0
+        self.rate_limited = 0
+
+        # Completion times over the last window, for the measured rate
+        self.window = 10.0
+        self.completed = deque()
+
+        self.lock = threading.Lock()
+
+    # Reserve a token and return how long to wait before using it
+    def _reserve(self):
+        with self.lock:
+            now = time.monotonic()
+
+            # While backing off, updated is in the future and nothing refills
+            if now > self.updated:
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+
+            # Tokens may go negative, queueing the caller behind earlier ones
+            self.tokens -= 1
+            self.in_flight += 1
+            metrics.in_flight.set(self.in_flight)
+
+            return (self.updated - now) + max(0.0, -self.tokens / self.rate)
+
+    def acquire(self):
+        time.sleep(self._reserve())
+
+    async def wait(self):
+        await asyncio.sleep(self._reserve())
+
+    # Report the outcome of a request. status is the HTTP status code, or None
+    # if the request failed without a response.
+    def release(self, status, latency):
+        with self.lock:
+            now = time.monotonic()
+            self.in_flight -= 1
+
+            self.completed.append(now)
+            while self.completed[0] < now - self.window:
+                self.completed.popleft()
+
+            if status == 429:
+                self.rate_limited += 1
+                # Rate limited pairs are always sent again
+                metrics.retries.inc()
+
+                # Only back off once per backoff period, every request sent
+                # before it started will come back limited as well
+                if now >= self.backoff_until:
+                    self.rate = max(self.min_rate, self.rate * self.decrease)
+                    self.backoff_until = now + self.backoff
+                    self.tokens = min(self.tokens, 0.0)
+                    self.updated = max(self.updated, self.backoff_until)
+                    metrics.backoff_seconds.inc(self.backoff)
+            elif status == 200:
+                if self.latency_target is not None and latency > self.latency_target:
+                    self.rate = max(self.min_rate, self.rate * self.decrease)
+                else:
+                    self.rate = min(
+                        self.max_rate, self.rate + self.increase / self.rate
+                    )
+
+            label = "error" if status is None else status
+            metrics.requests.inc(status=label)
+            metrics.request_seconds.observe(latency, status=label)
+            metrics.rate.set(self.rate)
+            metrics.in_flight.set(self.in_flight)
+
+    def backing_off(self):
+        return time.monotonic() < self.backoff_until
+
+    def stats(self):
+        with self.lock:
+            now = time.monotonic()
+            return {
+                "rate": self.rate,
+                "rps": sum(1 for t in self.completed if t >= now - self.window)
+                / self.window,
+                "in_flight": self.in_flight,
+                "backoff": max(0.0, self.backoff_until - now),
+                "rate_limited": self.rate_limited,
+            }
+
+    def summary(self):
+        stats = self.stats()
+        summary = (
+            f"Rate {stats['rate']:.2f}/s (measured {stats['rps']:.2f}/s), "
+            f"{stats['in_flight']} in flight"
+        )
+        if stats["backoff"] > 0:
+            summary += f", backing off for {stats['backoff']:.0f}s"
+        return summary
@@ -0,0 +1,220 @@
+import random
+
+from wordfreq import word_frequency
+from wordfreq.tokens import lossy_tokenize
+
+# Weighted random sampling over the elements of a RecipeGraph for the
+# weighted-random algorithm. Weights are cached per element id in a Fenwick
+# tree, so a draw is O(log n) and only elements whose stats changed since the
+# last draw are reweighed.
+
+
+class FenwickTree:
+    def __init__(self, weights=()):
+        self.build(list(weights))
+
+    def build(self, weights):
+        self.weights = weights
+        self.size = 1
+        while self.size < len(weights):
+            self.size *= 2
+
+        # Each node holds the sum of its range, built bottom up in O(n)
+        self.tree = [0.0] + list(weights) + [0.0] * (self.size - len(weights))
+        for i in range(1, self.size):
+            parent = i + (i & -i)
+            if parent <= self.size:
+                self.tree[parent] += self.tree[i]
+
+        # Count of updates since the last build, sums drift with float error
+        self.updates = 0
+
+    def __len__(self):
+        return len(self.weights)
+
+    def total(self):
+        return self.tree[self.size] if len(self.weights) > 0 else 0.0
+
+    def set(self, i, w):
+        if i >= len(self.weights):
+            self.weights.extend([0.0] * (i + 1 - len(self.weights)))
+            if len(self.weights) > self.size:
+                self.build(self.weights)
+
+        delta = w - self.weights[i]
+        if delta == 0:
+            return
+        self.weights[i] = w
+
+        self.updates += 1
+        if self.updates > len(self.weights):
+            self.build(self.weights)
+            return
+
+        i += 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    # Index of the element whose cumulative weight range contains u
+    def find(self, u):
+        i = 0
+        step = self.size
+        while step > 0:
+            if i + step <= self.size and self.tree[i + step] <= u:
+                i += step
+                u -= self.tree[i]
+            step //= 2
+        return min(i, len(self.weights) - 1)
+
+    # Draw up to k distinct indices, each with probability proportional to its
+    # weight among the ones not drawn yet
+    def sample(self, k, rng=random):
+        drawn = []
+        removed = []
+        try:
+            while len(drawn) < k:
+                total = self.total()
+                if total <= 0:
+                    break
+
+                i = self.find(rng.random() * total)
+                if self.weights[i] <= 0:
+                    # Float error can land on an empty slot, rebuild and retry
+                    self.build(self.weights)
+                    continue
+
+                drawn.append(i)
+                removed.append((i, self.weights[i]))
+                self.set(i, 0.0)
+        finally:
+            for i, w in removed:
+                self.set(i, w)
+
+        return drawn
+
+
+class WeightedSampler:
+    keys = ["commonality", "depth", "yield", "recipe_count", "freq"]
+
+    def __init__(self, graph, key, invert=False, only_word=False):
+        if key not in self.keys:
+            raise ValueError(f"Invalid key {key}")
+
+        self.graph = graph
+        self.key = key
+        self.invert = invert
+        self.only_word = only_word
+
+        # Commonality only depends on the text, so it is computed once per
+        # element. Elements normalizing to the same words share one slot,
+        # held by the shallowest of them.
+        self.commonality = {}
+        self.normalized = {}
+        self.holder = {}
+
+        # Ask the graph to record the ids whose stats change
+        graph.changed = set()
+
+        self.rebuild()
+
+    def rebuild(self):
+        self.graph.changed.clear()
+        self.holder = {}
+
+        self.raw = []
+        for i in range(len(self.graph)):
+            self.raw.append(self._raw_weight(i))
+
+        if self.invert:
+            # The inverted weights follow 1 / (p + 1e-6 / n) of the normalized
+            # weights, with the average weight frozen at build time
+            drawable = [w for w in self.raw if w is not None]
+            self.epsilon = 1e-6 * sum(drawable) / max(1, len(drawable))
+
+        self.tree = FenwickTree(self._weight(w) for w in self.raw)
+
+    def _depth(self, i):
+        # Unreachable elements sort first, like NULLs in ORDER BY depth
+        d = self.graph.depth[i]
+        return -1 if d is None else d
+
+    # Stop drawing an element, used when it loses its commonality slot
+    def _drop(self, i):
+        self.raw[i] = None
+        if hasattr(self, "tree"):
+            self.tree.set(i, 0.0)
+
+    # Weight of an element for the key, or None if it is never drawn
+    def _raw_weight(self, i):
+        graph = self.graph
+        if not graph.exists[i] or graph.names[i] == "Nothing":
+            return None
+
+        if self.key == "yield":
+            return (graph.yields[i] / (graph.recipe_count[i] + 1)) ** 4
+        elif self.key == "depth":
+            return float(graph.depth[i] or 0)
+        elif self.key == "recipe_count":
+            return float(graph.recipe_count[i])
+        elif self.key == "freq":
+            return float(graph.freq[i])
+
+        if i not in self.commonality:
+            text = graph.names[i]
+            normalized = tuple(lossy_tokenize(text, "en"))
+            self.normalized[i] = normalized
+            self.commonality[i] = word_frequency(text, "en", wordlist="large") / (
+                max(1, len(normalized)) ** 2
+            )
+
+        normalized = self.normalized[i]
+        if self.only_word and len(normalized) > 1:
+            return None
+
+        holder = self.holder.get(normalized)
+        if holder is not None and holder != i:
+            if self._depth(i) >= self._depth(holder):
+                return None
+            # Take the slot over from a deeper element
+            self._drop(holder)
+
+        self.holder[normalized] = i
+        return self.commonality[i]
+
+    def _weight(self, w):
+        if w is None:
+            return 0.0
+        if self.invert:
+            return 1 / (w + self.epsilon) if w + self.epsilon > 0 else 1.0
+        return w
+
+    # Reweigh the elements that changed since the last call
+    def update(self):
+        changed = self.graph.changed
+        for i in sorted(changed):
+            if i >= len(self.raw):
+                self.raw.extend([None] * (i + 1 - len(self.raw)))
+            self.raw[i] = self._raw_weight(i)
+            self.tree.set(i, self._weight(self.raw[i]))
+
+        n = len(changed)
+        changed.clear()
+        return n
+
+    def sample(self, k):
+        self.update()
+        return [self.graph.names[i] for i in self.tree.sample(k)]
+
+    # Elements and their probabilities, most likely first
+    def probabilities(self):
+        total = self.tree.total()
+        return sorted(
+            (
+                (self.graph.names[i], w / total)
+                for i, w in enumerate(self.tree.weights)
+                if w > 0
+            ),
+            key=lambda x: x[1],
+            reverse=True,
+        )
@@ -0,0 +1,190 @@
+import random
+
+from graph import pack
+
+# Scheduling for the max-yield, min-uses and max-freq algorithms. Elements are
+# kept in an indexable heap keyed by the algorithm's score and rescored as
+# results land, so picking the next batch doesn't scan the elements table.
+
+
+# Max-heap of ids with a position index, so any id can be rescored or removed
+# in O(log n)
+class IndexedHeap:
+    def __init__(self):
+        self.heap = []
+        self.position = {}
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __contains__(self, item):
+        return item in self.position
+
+    def _swap(self, x, y):
+        self.heap[x], self.heap[y] = self.heap[y], self.heap[x]
+        self.position[self.heap[x][1]] = x
+        self.position[self.heap[y][1]] = y
+
+    def _up(self, x):
+        while x > 0:
+            parent = (x - 1) // 2
+            if self.heap[parent][0] >= self.heap[x][0]:
+                break
+            self._swap(x, parent)
+            x = parent
+
+    def _down(self, x):
+        n = len(self.heap)
+        while True:
+            largest = x
+            for child in (2 * x + 1, 2 * x + 2):
+                if child < n and self.heap[child][0] > self.heap[largest][0]:
+                    largest = child
+            if largest == x:
+                break
+            self._swap(x, largest)
+            x = largest
+
+    # Insert the item or change its key
+    def push(self, item, key):
+        x = self.position.get(item)
+        if x is None:
+            self.heap.append((key, item))
+            self.position[item] = len(self.heap) - 1
+            self._up(len(self.heap) - 1)
+            return
+
+        old = self.heap[x][0]
+        self.heap[x] = (key, item)
+        if key > old:
+            self._up(x)
+        else:
+            self._down(x)
+
+    def remove(self, item):
+        x = self.position.pop(item, None)
+        if x is None:
+            return
+
+        last = self.heap.pop()
+        if x < len(self.heap):
+            self.heap[x] = last
+            self.position[last[1]] = x
+            self._up(x)
+            self._down(self.position[last[1]])
+
+    def pop(self):
+        key, item = self.heap[0]
+        self.remove(item)
+        return item, key
+
+
+class Scheduler:
+    algorithms = ["max-yield", "min-uses", "max-freq"]
+
+    def __init__(self, graph, algorithm, rng=random):
+        if algorithm not in self.algorithms:
+            raise ValueError(f"Invalid algorithm {algorithm}")
+
+        self.graph = graph
+        self.algorithm = algorithm
+        self.rng = rng
+
+        # Ids of the elements that can be combined, for drawing partners
+        self.pool = []
+        self.in_pool = set()
+        self.heap = IndexedHeap()
+        # Elements that have been combined with every element in the pool
+        self.saturated = set()
+        # Random tie breaks, so equal scores come out in random order
+        self.tiebreak = {}
+
+        # Ask the graph to record the ids whose stats change
+        graph.changed = set()
+        for i in range(len(graph)):
+            self._add(i)
+        for i in self.pool:
+            self._rescore(i)
+
+    def _add(self, i):
+        graph = self.graph
+        if i in self.in_pool or not graph.exists[i] or graph.names[i] == "Nothing":
+            return False
+
+        self.pool.append(i)
+        self.in_pool.add(i)
+        self.tiebreak[i] = self.rng.random()
+        return True
+
+    def score(self, i):
+        graph = self.graph
+        if self.algorithm == "max-yield":
+            return graph.yields[i] / (graph.recipe_count[i] + 1)
+        elif self.algorithm == "min-uses":
+            return -graph.recipe_count[i]
+        return graph.freq[i]
+
+    def _rescore(self, i):
+        if self.graph.recipe_count[i] >= len(self.pool):
+            self.heap.remove(i)
+            self.saturated.add(i)
+            return
+
+        self.saturated.discard(i)
+        self.heap.push(i, (self.score(i), self.tiebreak[i]))
+
+    # Pick up the elements and stats that changed since the last call
+    def update(self):
+        changed = self.graph.changed
+
+        added = False
+        for i in changed:
+            added |= self._add(i)
+
+        # New elements are new partners for the saturated elements too
+        if added:
+            changed.update(self.saturated)
+
+        for i in changed:
+            if i in self.in_pool:
+                self._rescore(i)
+
+        n = len(changed)
+        changed.clear()
+        return n
+
+    # The names of the k best elements
+    def top(self, k):
+        self.update()
+
+        best = []
+        while len(best) < k and len(self.heap) > 0:
+            best.append(self.heap.pop())
+        for i, key in best:
+            self.heap.push(i, key)
+
+        return [self.graph.names[i] for i, _ in best]
+
+    # Up to k random elements that have not been combined with a
+    def partners(self, a, k):
+        graph = self.graph
+        i = graph.id(a)
+        tried = graph.by_input[i]
+
+        if len(tried) < 0.7 * len(self.pool):
+            # Decently high chance of choosing a random element that has not
+            # been tried, just choose a random element until it works
+            picked = {}
+            for _ in range(k * 10):
+                j = self.rng.choice(self.pool)
+                if j not in picked and pack(i, j) not in graph.recipes:
+                    picked[j] = None
+                    if len(picked) == k:
+                        break
+            picked = list(picked)
+        else:
+            tried = set(tried)
+            untried = [j for j in self.pool if j not in tried]
+            picked = self.rng.sample(untried, min(k, len(untried)))
+
+        return [graph.names[j] for j in picked]
@@ -0,0 +1,203 @@
+import json
+import os
+import shutil
+import time
+from os import path
+
+import numpy as np
+
+# Columnar snapshots of the recipe graph for offline analysis. A snapshot is a
+# directory of .npy files that Snapshot memory-maps, so even a graph with
+# millions of recipes opens without reading or copying it:
+#
+#   strings, offsets              UTF-8 element names interned into one buffer,
+#                                 name i is strings[offsets[i]:offsets[i + 1]]
+#   emoji, emoji_offsets          the same for the emoji
+#   input1, input2, output        int32 element ids, recipes sorted by output
+#   output_offsets                recipes making element i are the rows
+#                                 output_offsets[i]:output_offsets[i + 1]
+#   depth, yield, recipe_count,
+#   freq                          int32 element stats, -1 for NULL
+#   discovered                    bool
+#   meta.json                     format version and counts
+#
+# Ids below n_elements are rows of the elements table in rowid order. Recipes
+# may reference text that is not in the table, which is interned after them.
+
+version = 1
+
+stats = ["depth", "yield", "recipe_count", "freq"]
+
+
+def _pack_strings(strings):
+    encoded = [s.encode() for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+# Write a snapshot of the database to the directory dirname, replacing any
+# snapshot already there. Returns (elements, recipes).
+def export_snapshot(cur, dirname, batch_size=100_000):
+    names = []
+    emoji = []
+    discovered = []
+    columns = {stat: [] for stat in stats}
+
+    for text, e, d, *values in cur.execute(
+        """
+        SELECT text, emoji, discovered, depth, yield, recipe_count, freq
+            FROM elements ORDER BY rowid
+        """
+    ):
+        names.append(text)
+        emoji.append(e or "")
+        discovered.append(bool(d))
+        for stat, value in zip(stats, values):
+            columns[stat].append(-1 if value is None else value)
+
+    ids = {text: i for i, text in enumerate(names)}
+    n_elements = len(names)
+
+    def intern(text):
+        i = ids.get(text)
+        if i is None:
+            i = len(names)
+            ids[text] = i
+            names.append(text)
+            emoji.append("")
+        return i
+
+    n_recipes = cur.execute("SELECT COUNT(*) FROM recipes").fetchone()[0]
+    recipes = np.empty((n_recipes, 3), dtype=np.int32)
+
+    # Fill the recipe arrays a batch at a time instead of building a list of
+    # every recipe first
+    rows = cur.execute("SELECT input1, input2, output FROM recipes")
+    filled = 0
+    while filled < n_recipes:
+        batch = rows.fetchmany(batch_size)
+        if len(batch) == 0:
+            break
+        recipes[filled : filled + len(batch)] = [
+            (intern(a), intern(b), intern(o)) for a, b, o in batch
+        ]
+        filled += len(batch)
+    recipes = recipes[:filled]
+
+    recipes = recipes[np.argsort(recipes[:, 2], kind="stable")]
+    output_offsets = np.zeros(len(names) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(recipes[:, 2], minlength=len(names)), out=output_offsets[1:])
+
+    # Elements interned from the recipes have no stats
+    missing = len(names) - n_elements
+    arrays = {
+        "input1": recipes[:, 0],
+        "input2": recipes[:, 1],
+        "output": recipes[:, 2],
+        "output_offsets": output_offsets,
+        "discovered": np.array(discovered + [False] * missing, dtype=bool),
+    }
+    for stat in stats:
+        arrays[stat] = np.array(columns[stat] + [-1] * missing, dtype=np.int32)
+    arrays["strings"], arrays["offsets"] = _pack_strings(names)
+    arrays["emoji"], arrays["emoji_offsets"] = _pack_strings(emoji)
+
+    # Write next to the target and rename it into place, so a reader never
+    # sees half a snapshot. The old snapshot is moved aside first and only
+    # deleted once the new one is in place, which leaves it in <dirname>.old
+    # if the export dies in between.
+    tmp = dirname.rstrip(os.sep) + ".tmp"
+    old = dirname.rstrip(os.sep) + ".old"
+    if path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+
+    for name, array in arrays.items():
+        np.save(path.join(tmp, f"{name}.npy"), np.ascontiguousarray(array))
+
+    with open(path.join(tmp, "meta.json"), "w") as f:
+        json.dump(
+            {
+                "version": version,
+                "time": time.time(),
+                "elements": n_elements,
+                "names": len(names),
+                "recipes": int(filled),
+            },
+            f,
+            indent=2,
+        )
+
+    if path.exists(old):
+        shutil.rmtree(old)
+    if path.exists(dirname):
+        os.replace(dirname, old)
+    os.replace(tmp, dirname)
+    if path.exists(old):
+        shutil.rmtree(old)
+
+    return n_elements, int(filled)
+
+
+class Snapshot:
+    def __init__(self, dirname, mmap=True):
+        with open(path.join(dirname, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        if self.meta["version"] != version:
+            raise ValueError(
+                f"Snapshot {dirname} has version {self.meta['version']}, expected {version}"
+            )
+
+        mode = "r" if mmap else None
+
+        def load(name):
+            return np.load(path.join(dirname, f"{name}.npy"), mmap_mode=mode)
+
+        self.n_elements = self.meta["elements"]
+        self.strings = load("strings")
+        self.offsets = load("offsets")
+        self.emoji_strings = load("emoji")
+        self.emoji_offsets = load("emoji_offsets")
+
+        self.input1 = load("input1")
+        self.input2 = load("input2")
+        self.output = load("output")
+        self.output_offsets = load("output_offsets")
+
+        self.depth = load("depth")
+        self.yields = load("yield")
+        self.recipe_count = load("recipe_count")
+        self.freq = load("freq")
+        self.discovered = load("discovered")
+
+        # Text -> id, built on first use
+        self._ids = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def name(self, i):
+        return self.strings[self.offsets[i] : self.offsets[i + 1]].tobytes().decode()
+
+    def emoji(self, i):
+        return (
+            self.emoji_strings[self.emoji_offsets[i] : self.emoji_offsets[i + 1]]
+            .tobytes()
+            .decode()
+        )
+
+    # Every name, decoded in one pass over the string buffer
+    def names(self):
+        buffer = self.strings.tobytes()
+        offsets = self.offsets.tolist()
+        return [buffer[offsets[i] : offsets[i + 1]].decode() for i in range(len(self))]
+
+    def id(self, text):
+        if self._ids is None:
+            self._ids = {text: i for i, text in enumerate(self.names())}
+        return self._ids[text]
+
+    # Row range of the recipes making element i
+    def recipes_making(self, i):
+        return slice(int(self.output_offsets[i]), int(self.output_offsets[i + 1]))
@@ -1,12 +1,20 @@
 import requests
+import sqlite3
 import time
-import random
 from urllib.parse import quote_plus
 import json
 import logging
 import sys
 import os
-from queue import SimpleQueue
+import heapq
+import zlib
+import argparse
+import metrics
+import atexit
+import queue
+from logging.handlers import QueueListener
+from logs import EventLogHandler, LocalQueueHandler, SummaryHandler
+from collections import Counter, deque
 
 # ANSI escape codes for color
 red = "\033[1;31m"
@@ -22,6 +30,26 @@ def norm_recipe(*recipe):
     return tuple(sorted(recipe))
 
 
+# Parse a "--shard i/N" value into (i, N), where 0 <= i < N
+def parse_shard(value):
+    try:
+        i, n = (int(x) for x in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid shard {value}, expected i/N")
+
+    if n < 1 or not 0 <= i < n:
+        raise argparse.ArgumentTypeError(f"Invalid shard {value}, need 0 <= i < N")
+    return i, n
+
+
+# Whether a pair belongs to the shard. The split is a hash of the normalized
+# pair, so every process agrees on it without coordinating.
+def in_shard(a, b, shard):
+    i, n = shard
+    a, b = norm_recipe(a, b)
+    return zlib.crc32(f"{a}\0{b}".encode()) % n == i
+
+
 def remove_nothings(con, cur):
     # Delete all recipes with Nothing as an input
     cur.execute("DELETE FROM recipes WHERE input1 = 'Nothing' OR input2 = 'Nothing'")
@@ -65,7 +93,17 @@ def _recalculate_depth_tree(cur, depth):
             )
 
 
-def recalculate_depth_tree(con, cur):
+# engine is either "numpy", which runs a vectorized BFS over the whole recipe
+# graph, or "sql", which walks the tree one depth level at a time in SQLite
+def recalculate_depth_tree(con, cur, engine="numpy"):
+    if engine == "numpy":
+        try:
+            from vectorized import recalculate_depth_numpy
+        except ImportError:
+            print(f"{yellow}NumPy is not available, using the SQL depth engine{reset}")
+        else:
+            recalculate_depth_numpy(con, cur)
+            return
 
     # Set depth of all elements to NULL
     cur.execute("UPDATE elements SET depth = NULL")
@@ -83,6 +121,29 @@ def recalculate_depth_tree(con, cur):
     con.commit()
 
 
+# Cross check the NumPy depth engine against the SQL engine, which is run on an
+# in-memory snapshot so the database is left untouched.
+# Returns a list of (element, sql depth, numpy depth) that disagree.
+def verify_depth_tree(con, cur):
+    from vectorized import compute_depths, unreachable
+
+    names, depth = compute_depths(cur)
+
+    snapshot = sqlite3.connect(":memory:")
+    con.backup(snapshot)
+    recalculate_depth_tree(snapshot, snapshot.cursor(), engine="sql")
+    expected = dict(snapshot.execute("SELECT text, depth FROM elements").fetchall())
+    snapshot.close()
+
+    mismatches = []
+    for text, d in zip(names, depth.tolist()):
+        d = None if d == unreachable else d
+        if expected.get(text) != d:
+            mismatches.append((text, expected.get(text), d))
+
+    return mismatches
+
+
 def recalculate_shortest_path(con, cur):
     # Delete the shortest path table
     cur.execute("DROP TABLE IF EXISTS shortest_path")
@@ -123,6 +184,45 @@ def recalculate_shortest_path(con, cur):
     con.commit()
 
 
+# Depth of every element along with the total input depth of its shortest path,
+# or None if the path is missing or not shallower than the element
+def _shortest_path_depths(cur):
+    return {
+        text: (depth, sd if sd is not None and sm < depth else None)
+        for text, depth, sd, sm in cur.execute(
+            """
+            SELECT elements.text, elements.depth, e1.depth + e2.depth, MAX(e1.depth, e2.depth)
+                FROM elements
+                LEFT JOIN shortest_path ON output = elements.text
+                LEFT JOIN elements AS e1 ON input1 = e1.text
+                LEFT JOIN elements AS e2 ON input2 = e2.text
+            """
+        )
+    }
+
+
+# Compare the incrementally maintained depth and shortest_path tables against
+# a full rebuild on an in-memory snapshot. Paths with equal total input depth
+# are interchangeable, so only the totals are compared.
+# Returns a list of (element, expected, actual) that disagree.
+def verify_shortest_path(con, cur):
+    actual = _shortest_path_depths(cur)
+
+    snapshot = sqlite3.connect(":memory:")
+    con.backup(snapshot)
+    scur = snapshot.cursor()
+    recalculate_depth_tree(snapshot, scur)
+    recalculate_shortest_path(snapshot, scur)
+    expected = _shortest_path_depths(scur)
+    snapshot.close()
+
+    return [
+        (text, expected[text], actual.get(text))
+        for text in expected
+        if expected[text] != actual.get(text)
+    ]
+
+
 #     cur.execute(
 #         """
 #         SELECT * FROM recipes
@@ -133,45 +233,80 @@ def recalculate_shortest_path(con, cur):
 #     )
 
 
-def recalculate_yield(con, cur):
-    # Set all counts to 0
-    cur.execute("UPDATE elements SET yield = 0")
-    cur.execute("UPDATE elements SET recipe_count = 0")
-    cur.execute("UPDATE elements SET freq = 0")
-
-    # Loop through all the recipes
-    recipes = cur.execute("SELECT * FROM recipes").fetchall()
-
-    unique_products = {}
+# Rebuild recipe_count, yield and freq with a few aggregate queries. Each
+# aggregate is materialized into a temporary table keyed by element, then
+# written back with one UPDATE per column. With affected, the name of a table
+# with a text column, only the elements listed in it are recalculated.
+def recalculate_yield(con, cur, affected=None):
+    def only(column):
+        return (
+            "" if affected is None else f"AND {column} IN (SELECT text FROM {affected})"
+        )
 
-    for a, b, c in recipes:
-        cur.execute(
-            "UPDATE elements SET recipe_count = recipe_count + 1 WHERE text = ? OR text = ?",
-            (a, b),
+    cur.execute("DROP TABLE IF EXISTS temp.element_stats")
+    cur.execute(
+        """
+        CREATE TEMP TABLE element_stats (
+            text TEXT PRIMARY KEY,
+            recipe_count INTEGER DEFAULT 0,
+            yield INTEGER DEFAULT 0,
+            freq INTEGER DEFAULT 0
         )
+        """
+    )
 
-        if c == "Nothing":
-            continue
+    # Number of recipes using each element, counting a + a once
+    cur.execute(
+        f"""
+        INSERT INTO element_stats (text, recipe_count)
+        SELECT input, COUNT(*) FROM (
+            SELECT input1 AS input FROM recipes WHERE 1 {only("input1")}
+            UNION ALL
+            SELECT input2 FROM recipes WHERE input2 <> input1 {only("input2")}
+        ) GROUP BY input
+        """
+    )
 
-        if a not in unique_products:
-            unique_products[a] = set()
-        if b not in unique_products:
-            unique_products[b] = set()
+    # Number of unique products of each element
+    cur.execute(
+        f"""
+        INSERT INTO element_stats (text, yield)
+        SELECT input, COUNT(DISTINCT output) FROM (
+            SELECT input1 AS input, output FROM recipes
+                WHERE output <> 'Nothing' {only("input1")}
+            UNION ALL
+            SELECT input2, output FROM recipes
+                WHERE output <> 'Nothing' {only("input2")}
+        ) GROUP BY input
+        ON CONFLICT (text) DO UPDATE SET yield = excluded.yield
+        """
+    )
 
-        unique_products[a].add(c)
-        unique_products[b].add(c)
+    # Number of recipes creating each element, not including the element itself
+    cur.execute(
+        f"""
+        INSERT INTO element_stats (text, freq)
+        SELECT output, COUNT(*) FROM recipes
+            WHERE output <> 'Nothing' AND input1 <> output AND input2 <> output
+                {only("output")}
+            GROUP BY output
+        ON CONFLICT (text) DO UPDATE SET freq = excluded.freq
+        """
+    )
 
-        if a != c and b != c:
-            cur.execute(
-                "UPDATE elements SET freq = freq + 1 WHERE text = ?",
-                (c,),
-            )
+    cur.execute(
+        f"UPDATE elements SET recipe_count = 0, yield = 0, freq = 0 WHERE 1 {only('text')}"
+    )
+    cur.execute(
+        """
+        UPDATE elements
+            SET recipe_count = s.recipe_count, yield = s.yield, freq = s.freq
+            FROM element_stats AS s
+            WHERE s.text = elements.text
+        """
+    )
 
-    for element, products in unique_products.items():
-        cur.execute(
-            "UPDATE elements SET yield = ? WHERE text = ?",
-            (len(products), element),
-        )
+    cur.execute("DROP TABLE element_stats")
 
     con.commit()
 
@@ -201,145 +336,300 @@ s = requests.Session()
 s.headers.update(headers)
 
 
-def combine(log, a, b):
+# Root of the API, overridable to point the crawler at a mock server
+api_root = os.environ.get("INFINITE_CRAFT_API", "https://neal.fun")
+
+
+def pair_url(a, b):
+    return f"{api_root}/api/infinite-craft/pair?first={quote_plus(a)}&second={quote_plus(b)}"
+
+
+# Failure caused by the pair itself rather than the network or rate limits,
+# which is remembered in the negative cache
+class PairError(Exception):
+    pass
+
+
+class RateLimited(Exception):
+    pass
+
+
+# The pair failed recently and is still backing off
+class NegativeCacheHit(Exception):
+    pass
+
+
+def parse_pair(log, a, b, text):
+    try:
+        j = json.loads(text)
+        if "emoji" not in j:
+            log.warning("No emoji for %s + %s: %s", a, b, j)
+        return (j["result"], j["isNew"], j["emoji"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise PairError(f"Invalid response: {e}")
+
+
+# Combine cache shared by everything in this process, see open_cache
+cache = None
+
+
+def open_cache(fname=None, ttl=60 * 10):
+    global cache
+    from cache import CombineCache
+
+    if fname is None:
+        cache = CombineCache(ttl=ttl)
+    else:
+        cache = CombineCache(fname, ttl=ttl)
+
+
+# Get the cached result of a pair, or None if it needs to be fetched
+def cache_lookup(a, b):
+    if cache is None:
+        return None
+
+    key = norm_recipe(a, b)
+    result = cache.get(*key)
+    if result is not None:
+        return result
+
+    retry_after = cache.retry_after(*key)
+    if retry_after is not None:
+        raise NegativeCacheHit(
+            f"Failed recently, retrying in {retry_after - time.time():.0f}s"
+        )
+
+    return None
+
+
+def cache_store(a, b, result):
+    if cache is not None:
+        cache.put(*norm_recipe(a, b), *result)
+
+
+def cache_fail(a, b, error):
+    if cache is not None:
+        cache.fail(*norm_recipe(a, b), error)
+
+
+# Combine two elements. Rate limits are waited out here unless
+# retry_rate_limit is False, in which case RateLimited is raised so the caller
+# can back off.
+def combine(log, a, b, retry_rate_limit=True):
+    result = cache_lookup(a, b)
+    if result is not None:
+        return result
+
     for _ in range(10):
         try:
-            # print(s.headers)
-            # print(
-            #     "Fetching",
-            #     f"https://neal.fun/api/infinite-craft/pair?first={quote_plus(a)}&second={quote_plus(b)}",
-            # )
-            r = s.get(
-                f"https://neal.fun/api/infinite-craft/pair?first={quote_plus(a)}&second={quote_plus(b)}",
-                timeout=30,
-            )
+            r = s.get(pair_url(a, b), timeout=30)
             s.cookies.update(r.cookies)
             if r.status_code == 500:
-                raise Exception("Internal Server Error")
+                raise PairError("Internal Server Error")
             elif r.status_code == 429:
-                raise TimeoutError("Rate Limited")
+                raise RateLimited("Rate Limited")
             elif r.status_code == 403:
                 raise Exception("Forbidden")
             elif r.status_code != 200:
-                raise Exception(r.status_code)
-            # Trim the response until the first {
-            # print(r.text)
-            # print(r.content)
-            # r = r.text[r.text.find("{") : r.text.rfind("}") + 1]
-            j = json.loads(r.text)
-            if "emoji" not in j:
-                print(a, b, j)
-            return (j["result"], j["isNew"], j["emoji"])
-        except TimeoutError as e:
+                raise PairError(r.status_code)
+            result = parse_pair(log, a, b, r.text)
+            break
+        except RateLimited as e:
+            if not retry_rate_limit:
+                raise
             log.error(f"Timed Out {a} and {b}: {e}")
             log.debug(f"Retrying in 1 Minute")
             time.sleep(60)
+        except PairError as e:
+            cache_fail(a, b, e)
+            raise
+    else:
+        raise Exception("Failed to combine elements")
 
-    raise Exception("Failed to combine elements")
-
+    cache_store(a, b, result)
+    return result
 
-# Update the depth of a given element and propogate the change
-def recursive_update_depth(cur, a, b, element, old_depth, depth):
-    q = SimpleQueue()
-    q.put((a, b, element, old_depth, depth))
-    count = 1
 
-    while count > 0:
-        if count > 1000:
-            # Too many things to update here, swap to the recalculate method
-            _recalculate_depth_tree(cur, depth)
-            return
-        a, b, element, old_depth, depth = q.get()
-        count -= 1
+# Incrementally maintain depth and shortest_path after the recipe a + b = element
+# has been inserted, where depth is max(depth(a), depth(b)) + 1.
+# This is Dijkstra's algorithm seeded with the new recipe: elements are settled
+# in order of increasing depth, so every element is settled at most once and a
+# full recompute is never needed.
+def update_depth(cur, a, b, element, depth, graph=None):
+    if graph is not None:
+        get_depth = graph.get_depth
+    else:
 
-        if old_depth < depth:
-            return
-        elif old_depth == depth:
-            # Here, we need to check if the shortest path has changed
-            # Get the old shortest path
-            s1, s2 = cur.execute(
-                "SELECT input1, input2 FROM shortest_path WHERE output = ?", (element,)
+        def get_depth(text):
+            row = cur.execute(
+                "SELECT depth FROM elements WHERE text = ?", (text,)
             ).fetchone()
+            return None if row is None else row[0]
 
-            # Get the depth of the two input elements
-            d1 = cur.execute(
-                "SELECT depth FROM elements WHERE text = ?", (a,)
-            ).fetchone()[0]
-
-            d2 = cur.execute(
-                "SELECT depth FROM elements WHERE text = ?", (b,)
-            ).fetchone()[0]
+    def set_depth(text, d):
+        cur.execute("UPDATE elements SET depth = ? WHERE text = ?", (d, text))
+        if graph is not None:
+            graph.set_depth(text, d)
 
-            # Get the depths of the old shortest path
-            sd1 = cur.execute(
-                "SELECT depth FROM elements WHERE text = ?", (s1,)
-            ).fetchone()[0]
-            sd2 = cur.execute(
-                "SELECT depth FROM elements WHERE text = ?", (s2,)
-            ).fetchone()[0]
+    def set_shortest_path(output, input1, input2):
+        cur.execute(
+            "INSERT OR REPLACE INTO shortest_path (output, input1, input2) VALUES (?, ?, ?)",
+            (output, input1, input2),
+        )
 
-            if d1 + d2 < sd1 + sd2:
-                cur.execute(
-                    """
-                    INSERT OR REPLACE INTO shortest_path (output, input1, input2) VALUES (?, ?, ?)
-                    """,
-                    (element, a, b),
-                )
+    # Point the shortest path at the recipe (input1, input2) if it is valid for
+    # the output's depth and has a lower total input depth than the current one
+    def improve_shortest_path(output, output_depth, input1, d1, input2, d2):
+        if max(d1, d2) >= output_depth:
             return
+
+        row = cur.execute(
+            "SELECT input1, input2 FROM shortest_path WHERE output = ?", (output,)
+        ).fetchone()
+
+        if row is not None:
+            sd1 = get_depth(row[0])
+            sd2 = get_depth(row[1])
+            if (
+                sd1 is not None
+                and sd2 is not None
+                and max(sd1, sd2) < output_depth
+                and sd1 + sd2 <= d1 + d2
+            ):
+                return
+
+        set_shortest_path(output, input1, input2)
+
+    # Pick the recipe with the lowest total input depth among the recipes
+    # whose inputs are all shallower than the element
+    def rebuild_shortest_path(output, output_depth):
+        if graph is not None:
+            creators = [
+                (get_depth(x), get_depth(y), x, y) for x, y in graph.creators(output)
+            ]
         else:
-            # Always update the shortest path as the depth has changed
-            cur.execute(
+            creators = cur.execute(
                 """
-                INSERT OR REPLACE INTO shortest_path (output, input1, input2) VALUES (?, ?, ?)
+                SELECT e1.depth, e2.depth, input1, input2 FROM recipes
+                    JOIN elements AS e1 ON input1 = e1.text
+                    JOIN elements AS e2 ON input2 = e2.text
+                    WHERE output = ?
                 """,
-                (element, a, b),
-            )
+                (output,),
+            ).fetchall()
+
+        best = None
+        for d1, d2, x, y in creators:
+            if d1 is None or d2 is None or max(d1, d2) >= output_depth:
+                continue
+            if best is None or d1 + d2 < best[0]:
+                best = (d1 + d2, x, y)
+
+        if best is not None:
+            set_shortest_path(output, best[1], best[2])
+
+    # Recipes using the element, as (other input, depth of other input, output)
+    def uses(text):
+        if graph is not None:
+            return [(y, get_depth(y), o) for y, o in graph.uses(text)]
+
+        return [
+            (y if x == text else x, dy if x == text else dx, o)
+            for x, dx, y, dy, o in cur.execute(
+                """
+                SELECT input1, e1.depth, input2, e2.depth, output FROM recipes
+                    JOIN elements AS e1 ON input1 = e1.text
+                    JOIN elements AS e2 ON input2 = e2.text
+                    WHERE input1 = ? OR input2 = ?
+                """,
+                (text, text),
+            ).fetchall()
+        ]
 
-        print(f"Updating depth of {element} from {old_depth} to {depth}")
+    old_depth = get_depth(element)
 
-        # Update the depth of the element
-        cur.execute("UPDATE elements SET depth = ? WHERE text = ?", (depth, element))
+    if old_depth is not None and depth >= old_depth:
+        # The depth is unchanged, but the new recipe may still be a shorter path
+        improve_shortest_path(element, old_depth, a, get_depth(a), b, get_depth(b))
+        return
 
-        # Find all recipes that use the element
-        recipes = cur.execute(
-            """
-            SELECT input1, e1.depth, input2, e2.depth, output, eo.depth FROM recipes
-                JOIN elements AS e1 ON input1 = e1.text
-                JOIN elements AS e2 ON input2 = e2.text
-                JOIN elements AS eo ON output = eo.text
-                WHERE (input1 = ? OR input2 = ?)
-                    AND eo.depth >= ?
-            """,
-            (element, element, depth + 1),
-        ).fetchall()
+    set_depth(element, depth)
+    heap = [(depth, element)]
+
+    while len(heap) > 0:
+        d, x = heapq.heappop(heap)
+
+        # Skip entries that were superseded by a lower depth
+        if get_depth(x) != d:
+            continue
 
-        # Propogate the change to the output elements
-        for input1, d1, input2, d2, output, old_depth in recipes:
-            if input1 == element:
-                d1 = depth
-            if input2 == element:
-                d2 = depth
+        rebuild_shortest_path(x, d)
 
-            q.put((input1, input2, output, old_depth, max(d1, d2) + 1))
-            count += 1
+        # Propagate the change to the outputs of every recipe using x
+        for y, dy, output in uses(x):
+            if dy is None or output == x:
+                continue
+            if y == x:
+                dy = d
+
+            candidate = max(d, dy) + 1
+            old = get_depth(output)
+
+            if old is None or candidate < old:
+                set_depth(output, candidate)
+                heapq.heappush(heap, (candidate, output))
+            else:
+                improve_shortest_path(output, old, x, d, y, dy)
 
 
 def is_numeric(s: str) -> bool:
     return any(c.isdigit() for c in s)
 
 
+# Runs in the pool workers. Returns the pair, the HTTP status (None if there
+# was no usable response), the latency and the result if there is one.
 def async_insert_combination(log, a, b):
+    t_start = time.time()
     try:
-        result, is_new, emoji = combine(log, a, b)
+        result, is_new, emoji = combine(log, a, b, retry_rate_limit=False)
+    except RateLimited:
+        return a, b, 429, time.time() - t_start, None
+    except NegativeCacheHit as e:
+        log.debug(f"Skipping {a} and {b}: {e}")
+
+        return a, b, None, 0, None
     except Exception as e:
         log.error(f"Failed to combine {a} and {b}: {e}")
 
-        return None
+        return a, b, None, time.time() - t_start, None
+
+    return a, b, 200, time.time() - t_start, (a, b, result, is_new, emoji)
+
 
-    return a, b, result, is_new, emoji
+def new_counters():
+    return {"recipe_count": Counter(), "yield": Counter(), "freq": Counter()}
+
+
+# Apply accumulated counter increments with one executemany per column
+def flush_counters(cur, counters, graph=None):
+    if graph is not None:
+        graph.apply_counters(counters)
+
+    for column, counts in counters.items():
+        if len(counts) == 0:
+            continue
+
+        cur.executemany(
+            f"UPDATE elements SET {column} = {column} + ? WHERE text = ?",
+            [(n, text) for text, n in counts.items()],
+        )
+        counts.clear()
 
 
-def insert_recipe(log, cur, con, a, b, result, emoji, is_new):
+# Insert a recipe without committing. Counter updates are accumulated into
+# counters and must be written with flush_counters. If a RecipeGraph is given,
+# lookups are answered from memory and the graph is kept in sync.
+def apply_recipe(log, cur, counters, a, b, result, emoji, is_new, graph=None):
     a, b = norm_recipe(a, b)
 
     # Insert the new recipe into the database
@@ -348,100 +638,236 @@ def insert_recipe(log, cur, con, a, b, result, emoji, is_new):
         (a, b, result),
     )
 
-    new_element = (
-        cur.execute(
-            "SELECT COUNT(*) FROM elements WHERE text = ?", (result,)
-        ).fetchone()[0]
-        == 0
-    )
+    # Already recorded, don't count it twice
+    if cur.rowcount == 0:
+        return
+    metrics.recipes.inc()
+
+    if graph is not None:
+        new_element = not graph.has_element(result)
+        # Inputs that had not created the result before this recipe
+        products = graph.add_recipe(a, b, result) or set()
+    else:
+        new_element = (
+            cur.execute(
+                "SELECT COUNT(*) FROM elements WHERE text = ?", (result,)
+            ).fetchone()[0]
+            == 0
+        )
 
     # Add 1 recipe count to both input elements
-    cur.execute(
-        "UPDATE elements SET recipe_count = recipe_count + 1 WHERE text = ? OR text = ?",
-        (a, b),
-    )
+    counters["recipe_count"][a] += 1
+    if a != b:
+        counters["recipe_count"][b] += 1
+
+    if a != result and b != result:
+        # Freq
+        counters["freq"][result] += 1
 
     # Get the depth of the input elements
-    d1 = cur.execute("SELECT depth FROM elements WHERE text = ?", (a,)).fetchone()[0]
-    d2 = cur.execute("SELECT depth FROM elements WHERE text = ?", (b,)).fetchone()[0]
+    if graph is not None:
+        d1 = graph.get_depth(a)
+        d2 = graph.get_depth(b)
+    else:
+        d1 = cur.execute("SELECT depth FROM elements WHERE text = ?", (a,)).fetchone()[
+            0
+        ]
+        d2 = cur.execute("SELECT depth FROM elements WHERE text = ?", (b,)).fetchone()[
+            0
+        ]
 
-    # Calculate the depth of the new element
-    depth = max(d1, d2) + 1
+    # Calculate the depth of the new element, unless an input is unreachable
+    depth = None if d1 is None or d2 is None else max(d1, d2) + 1
 
     # if the element is new:
     if new_element:
 
         # Add 1 yield to both input elements
-        cur.execute(
-            "UPDATE elements SET yield = yield + 1 WHERE text = ? OR text = ?",
-            (a, b),
-        )
+        counters["yield"][a] += 1
+        if a != b:
+            counters["yield"][b] += 1
 
         log.info(
-            f"{purple + 'First Discovery' if is_new else green + 'New Element'}\n\t{a} + {b} = {emoji} {result}{reset}"
+            "%s\n\t%s + %s = %s %s%s",
+            purple + "First Discovery" if is_new else green + "New Element",
+            a,
+            b,
+            emoji,
+            result,
+            reset,
+            extra={"event": "discovery", "recipe": (a, b, result, emoji, is_new)},
         )
+        metrics.new_elements.inc(first_discovery="true" if is_new else "false")
 
         # Insert the new element into the database
         cur.execute(
-            "INSERT OR IGNORE INTO elements VALUES (?, ?, ?, ?, 0, 0, ?)",
-            (result, emoji, is_new, depth, a != result and b != result),
+            "INSERT OR IGNORE INTO elements VALUES (?, ?, ?, ?, 0, 0, 0)",
+            (result, emoji, is_new, depth),
         )
+        if graph is not None:
+            graph.add_element(result, depth)
 
         # Insert this recipe as the shortest path
-        cur.execute(
-            "INSERT OR REPLACE INTO shortest_path (output, input1, input2) VALUES (?, ?, ?)",
-            (result, a, b),
-        )
-    else:
-        if a != result and b != result:
-            # Freq
+        if depth is not None:
             cur.execute(
-                "UPDATE elements SET freq = freq + 1 WHERE text = ?",
-                (result,),
+                "INSERT OR REPLACE INTO shortest_path (output, input1, input2) VALUES (?, ?, ?)",
+                (result, a, b),
             )
-
+    else:
         # Check if this element has been created before by the left and right elements
         # If it hasn't, update the yield respectively
+        if graph is not None:
+            for x in products:
+                counters["yield"][x] += 1
+        else:
+            if (
+                cur.execute(
+                    """
+                        SELECT COUNT(*) FROM recipes WHERE output = ? AND (input1 = ? OR input2 = ?)
+                                """,
+                    (result, a, a),
+                ).fetchone()[0]
+                == 1
+            ):
+                counters["yield"][a] += 1
+            if a != b and (
+                cur.execute(
+                    """
+                        SELECT COUNT(*) FROM recipes WHERE output = ? AND (input1 = ? OR input2 = ?)
+                                """,
+                    (result, b, b),
+                ).fetchone()[0]
+                == 1
+            ):
+                counters["yield"][b] += 1
+
+        log.debug(
+            "%s%s + %s = %s %s%s",
+            cyan,
+            a,
+            b,
+            emoji,
+            result,
+            reset,
+            extra={"event": "recipe"},
+        )
+
+        if depth is not None:
+            update_depth(cur, a, b, result, depth, graph)
+
+
+def insert_recipe(log, cur, con, a, b, result, emoji, is_new, graph=None):
+    counters = new_counters()
+    apply_recipe(log, cur, counters, a, b, result, emoji, is_new, graph)
+    flush_counters(cur, counters, graph)
+    con.commit()
+
+
+# Single writer for combine results. Results are queued and applied in
+# grouped transactions, committing once every batch_size results or once
+# flush_interval seconds have passed since the last commit.
+#
+# With shared=True other crawler processes write to the same database, so
+# every transaction takes the write lock up front and first catches the graph
+# up with whatever the others committed.
+class RecipeWriter:
+    def __init__(
+        self,
+        log,
+        con,
+        cur,
+        batch_size=100,
+        flush_interval=5.0,
+        graph=None,
+        shared=False,
+    ):
+        self.log = log
+        self.con = con
+        self.cur = cur
+        self.graph = graph
+        self.shared = shared
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = deque()
+        self.last_flush = time.monotonic()
+        # Changes whenever another connection commits to the database
+        self.data_version = self._data_version()
+
+    def _data_version(self):
+        return self.cur.execute("PRAGMA data_version").fetchone()[0]
+
+    # Bring the graph up to date with commits from other processes
+    def sync(self):
+        if self.graph is None:
+            return
+
+        version = self._data_version()
+        if version == self.data_version:
+            return
+
+        self.data_version = version
+        n = self.graph.sync(self.cur)
+        self.log.debug(f"Synced {n} elements written by other crawlers")
+
+    def __len__(self):
+        return len(self.queue)
+
+    def put(self, a, b, result, emoji, is_new):
+        self.queue.append((a, b, result, emoji, is_new))
+        metrics.write_queue.set(len(self.queue))
+
         if (
-            cur.execute(
-                """
-                    SELECT COUNT(*) FROM recipes WHERE output = ? AND (input1 = ? OR input2 = ?)
-                            """,
-                (result, a, a),
-            ).fetchone()[0]
-            == 1
-        ):
-            cur.execute(
-                "UPDATE elements SET yield = yield + 1 WHERE text = ?",
-                (a,),
-            )
-        if a != b and (
-            cur.execute(
-                """
-                    SELECT COUNT(*) FROM recipes WHERE output = ? AND (input1 = ? OR input2 = ?)
-                            """,
-                (result, b, b),
-            ).fetchone()[0]
-            == 1
+            len(self.queue) >= self.batch_size
+            or time.monotonic() - self.last_flush >= self.flush_interval
         ):
-            cur.execute(
-                "UPDATE elements SET yield = yield + 1 WHERE text = ?",
-                (b,),
-            )
+            self.flush()
 
-        log.debug(f"{cyan}{a} + {b} = {emoji} {result}{reset}")
+    def flush(self):
+        self.last_flush = time.monotonic()
 
-        old_depth = cur.execute(
-            "SELECT depth FROM elements WHERE text = ?", (result,)
-        ).fetchone()[0]
+        if len(self.queue) == 0:
+            return
 
-        if old_depth >= depth:
-            recursive_update_depth(cur, a, b, result, old_depth, depth)
+        t_start = time.perf_counter()
+        counters = new_counters()
+        try:
+            if self.shared:
+                # Wait for the write lock instead of failing to upgrade a
+                # read transaction halfway through the batch
+                if not self.con.in_transaction:
+                    self.cur.execute("BEGIN IMMEDIATE")
+                self.sync()
+
+            for a, b, result, emoji, is_new in self.queue:
+                apply_recipe(
+                    self.log,
+                    self.cur,
+                    counters,
+                    a,
+                    b,
+                    result,
+                    emoji,
+                    is_new,
+                    self.graph,
+                )
+            flush_counters(self.cur, counters, self.graph)
+            self.con.commit()
+        except BaseException:
+            # Leave the queue intact so a later flush can retry the batch
+            self.con.rollback()
+            if self.graph is not None:
+                self.graph.reload(self.cur)
+            raise
 
-    con.commit()
+        self.queue.clear()
+        metrics.db_write_seconds.observe(time.perf_counter() - t_start)
+        metrics.write_queue.set(0)
 
+    def close(self):
+        self.flush()
 
-def insert_combination(log, pool, args, con, cur, inputs) -> list[str]:
+
+def insert_combination(log, engine, args, con, cur, writer, inputs) -> list[str]:
     # Filter out numeric elements
     if args.skip_numeric:
         inputs = [(a, b) for a, b in inputs if not (is_numeric(a) or is_numeric(b))]
@@ -455,92 +881,96 @@ def insert_combination(log, pool, args, con, cur, inputs) -> list[str]:
     # Filter unique
     inputs = list(set(inputs))
 
+    # Only keep the pairs this crawler's shard is responsible for
+    if args.shard is not None:
+        inputs = [(a, b) for a, b in inputs if in_shard(a, b, args.shard)]
+
     # Filter out recipes we have already tried
-    inputs = [
-        (a, b)
-        for a, b in inputs
-        if cur.execute(
-            "SELECT COUNT(*) FROM recipes WHERE input1 = ? AND input2 = ?", (a, b)
-        ).fetchone()[0]
-        == 0
-    ]
+    if writer.graph is not None:
+        inputs = [(a, b) for a, b in inputs if not writer.graph.is_tried(a, b)]
+    else:
+        inputs = [
+            (a, b)
+            for a, b in inputs
+            if cur.execute(
+                "SELECT COUNT(*) FROM recipes WHERE input1 = ? AND input2 = ?", (a, b)
+            ).fetchone()[0]
+            == 0
+        ]
 
     log.info(f"Pushing new batch with {len(inputs)} items")
 
-    results = []
     text_results = []
 
+    def on_result(a, b, result, is_new, emoji):
+        text_results.append(result)
+        writer.put(a, b, result, emoji, is_new)
+
     try:
-        for a, b in inputs:
-            results.append(
-                pool.apply_async(
-                    async_insert_combination,
-                    args=(log, a, b),
-                )
-            )
+        engine.combine_all(log, inputs, on_result)
+    finally:
+        # Make the batch visible to the algorithms before they query it again
+        writer.flush()
 
-            t_start = time.time()
-
-            newres = []
-            for r in results:
-                if not r.ready():
-                    newres.append(r)
-                else:
-                    res = r.get()
-                    if res is not None:
-                        a, b, result, is_new, emoji = res
-                        text_results.append(result)
-                        insert_recipe(log, cur, con, a, b, result, emoji, is_new)
-
-            results = newres
-
-            # Wait
-            time.sleep(
-                max(
-                    random.uniform(0.1, 0.12) - (time.time() - t_start),
-                    0,
-                )
-            )
+    return text_results
 
-        for r in results:
-            res = r.get()
-            if res is not None:
-                a, b, result, is_new, emoji = res
-                text_results.append(result)
-                insert_recipe(log, cur, con, a, b, result, emoji, is_new)
-    except KeyboardInterrupt:
-        log.error("Keyboard Interrupt")
-        pool.terminate()
-        raise
 
-    return text_results
+# Stop the listener thread of an earlier setup_logging, writing out what it
+# still has queued
+# log.listener is only set while its listener thread is running
+def stop_logging(log):
+    listener = getattr(log, "listener", None)
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+    log.listener = None
+
+    for handler in list(log.handlers):
+        log.removeHandler(handler)
+
+
+_stop_registered = False
 
 
-def setup_logging():
+# Records are formatted and written by a listener thread. With summary_interval
+# the per-recipe lines are replaced by a summary every that many seconds, and
+# with events every discovery is appended to that JSONL file.
+def setup_logging(summary_interval=None, events=None):
     # Set up logging
     log = logging.getLogger(__name__)
     log.setLevel(logging.DEBUG)
+    stop_logging(log)
     # SEt format for log messages
     log_format = logging.Formatter("%(levelname)s:\t%(message)s")
     # Set up a handler to write to the console
     console_handler = logging.StreamHandler(sys.stderr)
     console_handler.setFormatter(log_format)
+
+    handlers = [console_handler]
+    if summary_interval is not None:
+        handlers = [SummaryHandler(console_handler, summary_interval)]
+    if events is not None:
+        handlers.append(EventLogHandler(events))
+
     # Add the handler to the logger
-    log.addHandler(console_handler)
+    listener = QueueListener(queue.SimpleQueue(), *handlers)
+    log.addHandler(LocalQueueHandler(listener.queue, console_handler))
+    log.listener = listener
+    listener.start()
+
+    # Flush whatever listener is running at exit, registered only once however
+    # many times logging is set up
+    global _stop_registered
+    if not _stop_registered:
+        atexit.register(stop_logging, log)
+        _stop_registered = True
 
     # Color for warning, error, and info messages.
-    logging.addLevelName(
-        logging.DEBUG, f"{blue}{logging.getLevelName(logging.DEBUG)}{reset}"
-    )
-    logging.addLevelName(
-        logging.INFO, f"{green}{logging.getLevelName(logging.INFO)}{reset}"
-    )
-    logging.addLevelName(
-        logging.WARNING, f"{yellow}{logging.getLevelName(logging.WARNING)}{reset}"
-    )
-    logging.addLevelName(
-        logging.ERROR, f"{red}{logging.getLevelName(logging.ERROR)}{reset}"
-    )
+    logging.addLevelName(logging.DEBUG, f"{blue}DEBUG{reset}")
+    logging.addLevelName(logging.INFO, f"{green}INFO{reset}")
+    logging.addLevelName(logging.WARNING, f"{yellow}WARNING{reset}")
+    logging.addLevelName(logging.ERROR, f"{red}ERROR{reset}")
 
     return log
 
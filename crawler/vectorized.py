@@ -0,0 +1,123 @@
+import numpy as np
+
+# Vectorized versions of the full-table recalculations in utils. The recipes
+# table is interned once into integer arrays and all the work happens in NumPy.
+
+base_elements = ("Water", "Fire", "Wind", "Earth")
+
+# Depth of elements that cannot be reached from the base elements
+unreachable = np.iinfo(np.int32).max
+
+
+# Load the recipes table as three parallel int32 arrays of element ids.
+# Ids below len(names) are rows of the elements table; recipes may reference
+# text that is not in the table, which is interned after them.
+def load_recipe_arrays(cur):
+    names = [text for text, in cur.execute("SELECT text FROM elements")]
+    ids = {text: i for i, text in enumerate(names)}
+    n_elements = len(names)
+
+    def intern(text):
+        i = ids.get(text)
+        if i is None:
+            i = len(names)
+            ids[text] = i
+            names.append(text)
+        return i
+
+    recipes = [
+        (intern(a), intern(b), intern(o))
+        for a, b, o in cur.execute("SELECT input1, input2, output FROM recipes")
+    ]
+    recipes = np.array(recipes, dtype=np.int32).reshape(-1, 3)
+
+    return (
+        names,
+        n_elements,
+        np.ascontiguousarray(recipes[:, 0]),
+        np.ascontiguousarray(recipes[:, 1]),
+        np.ascontiguousarray(recipes[:, 2]),
+    )
+
+
+# Build a CSR index from element id to the ids of the recipes using it
+def input_csr(n, in1, in2):
+    rids = np.arange(len(in1), dtype=np.int64)
+    distinct = in1 != in2
+
+    # Each recipe is listed under both inputs, once if they are the same
+    nodes = np.concatenate([in1, in2[distinct]])
+    edges = np.concatenate([rids, rids[distinct]])
+
+    order = np.argsort(nodes, kind="stable")
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(nodes, minlength=n), out=indptr[1:])
+
+    return indptr, edges[order]
+
+
+# Gather the CSR rows of every node in the frontier into one array
+def gather(indptr, indices, frontier):
+    starts = indptr[frontier]
+    lengths = indptr[frontier + 1] - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return indices[:0]
+
+    offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return indices[offsets + np.arange(total)]
+
+
+# Level-synchronous BFS from the base elements. An element's depth is one more
+# than the smallest max(depth(a), depth(b)) over the recipes creating it.
+def depth_bfs(names, n_elements, in1, in2, out):
+    n = len(names)
+    depth = np.full(n, unreachable, dtype=np.int32)
+
+    frontier = np.array(
+        [i for i, text in enumerate(names[:n_elements]) if text in base_elements],
+        dtype=np.int64,
+    )
+    depth[frontier] = 0
+
+    indptr, indices = input_csr(n, in1, in2)
+
+    level = 0
+    while len(frontier) > 0:
+        rids = np.unique(gather(indptr, indices, frontier))
+
+        # Recipes whose deepest input is on the current level
+        deepest = np.maximum(depth[in1[rids]], depth[in2[rids]])
+        outputs = out[rids[deepest == level]]
+
+        # Only rows of the elements table get a depth
+        outputs = np.unique(outputs[outputs < n_elements])
+        outputs = outputs[depth[outputs] == unreachable]
+
+        print(f"Found {len(outputs)} new elements at depth {level + 1}")
+
+        level += 1
+        depth[outputs] = level
+        frontier = outputs
+
+    return depth[:n_elements]
+
+
+def compute_depths(cur):
+    names, n_elements, in1, in2, out = load_recipe_arrays(cur)
+    depth = depth_bfs(names, n_elements, in1, in2, out)
+    return names[:n_elements], depth
+
+
+def recalculate_depth_numpy(con, cur):
+    names, depth = compute_depths(cur)
+
+    reached = np.flatnonzero(depth != unreachable)
+
+    # Write everything back in one transaction
+    cur.execute("UPDATE elements SET depth = NULL")
+    cur.executemany(
+        "UPDATE elements SET depth = ? WHERE text = ?",
+        ((int(depth[i]), names[i]) for i in reached),
+    )
+    con.commit()